@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+pyCFG benchmarks
+
+Times grammar transforms and CYK algorithm on synthetic grammars of growing size and writes the
+results as JSON, so runs of different versions can be compared:
+
+    python bench.py --output new.json --compare old.json
+"""
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+from copy import copy
+
+from cfg import CFG, normal_form_cache
+
+
+def _var(i):
+    """
+    Returns the name of i-th generated variable. Names are delimited, so they cannot contain each other.
+    """
+    return '<{}>'.format(i)
+
+
+def many_variables(n):
+    """
+    Grammar with n variables, each with a few rules that refer to other variables.
+    """
+    rules = {'S': [_var(0)]}
+    for i in range(n):
+        rules[_var(i)] = ['a' + _var((i + 1) % n) + 'b', _var((i * 7 + 3) % n) + 'a', 'b']
+
+    return CFG(terminals={'a', 'b', 'λ'}, rules=rules)
+
+
+def long_rules(n):
+    """
+    Grammar whose rules have bodies of length n.
+    """
+    return CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={
+            'S': [_var(0) * n, 'a' + 'S' * (n // 2) + 'b', 'a'],
+            _var(0): ['a', 'b', 'S'],
+        }
+    )
+
+
+def nullable_chain(n):
+    """
+    Grammar whose start variable is nullable through a chain of n variables.
+    """
+    rules = {'S': [_var(0) + 'a' + _var(0)]}
+    for i in range(n):
+        rules[_var(i)] = [_var(i + 1) + _var(i + 1), 'a' + _var(i + 1)]
+    rules[_var(n)] = ['λ', 'b']
+
+    return CFG(terminals={'a', 'b', 'λ'}, rules=rules)
+
+
+def unit_cycle(n):
+    """
+    Grammar with a cycle of n unit rules.
+    """
+    rules = {'S': [_var(0)]}
+    for i in range(n):
+        rules[_var(i)] = [_var((i + 1) % n), 'a' + _var(i) + 'b']
+    rules[_var(0)].append('c')
+
+    return CFG(terminals={'a', 'b', 'c', 'λ'}, rules=rules)
+
+
+def ambiguous(n):
+    """
+    Grammar with exponentially many derivations per string, made of n interchangeable variables.
+    """
+    rules = {'S': ['SS', 'a'] + [_var(i) for i in range(n)]}
+    for i in range(n):
+        rules[_var(i)] = ['SS', 'S' + _var(i), 'a']
+
+    return CFG(terminals={'a', 'λ'}, rules=rules)
+
+
+generators = {
+    'many_variables': many_variables,
+    'long_rules': long_rules,
+    'nullable_chain': nullable_chain,
+    'unit_cycle': unit_cycle,
+    'ambiguous': ambiguous,
+}
+
+sizes = {
+    'full': (4, 16, 32, 64),
+    'quick': (2, 4, 8),
+}
+
+input_lengths = {
+    'full': (8, 16, 32, 64),
+    'quick': (4, 8),
+}
+
+
+def _timed(function, repeat):
+    """
+    Returns the least wall time of repeat calls of function, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def _transformed(cfg, *transforms):
+    """
+    Returns a copy of cfg with passed method names applied in order.
+    """
+    cfg = copy(cfg)
+    for transform in transforms:
+        getattr(cfg, transform)()
+
+    return cfg
+
+
+def run(preset='full', repeat=3, seed=0, selected=None):
+    """
+    Runs the benchmarks and returns the list of result dicts.
+
+    Parameters
+        preset (optional, defaults to 'full'): 'full' or 'quick' sizes and input lengths
+        repeat (optional, defaults to 3): number of timed runs, the least time is kept
+        seed (optional, defaults to 0): seed of random input strings
+        selected (optional): names of generators to run, defaults to all
+    """
+    results = []
+    # Cached normal forms would make every run after the first one free
+    maxsize = normal_form_cache.maxsize
+    normal_form_cache.maxsize = 0
+    try:
+        for name, generator in generators.items():
+            if selected and name not in selected:
+                continue
+
+            for size in sizes[preset]:
+                cfg = generator(size)
+                result = {
+                    'grammar': name,
+                    'size': size,
+                    'variables': len(cfg.variables),
+                    'rules': len(cfg.rules),
+                }
+
+                # Every transform is timed on the input the application gives it
+                phases = (
+                    ('remove_null_rules', (), 'remove_null_rules'),
+                    ('remove_unit_rules', ('remove_null_rules',), 'remove_unit_rules'),
+                    ('reduct', ('remove_null_rules', 'remove_unit_rules'), 'reduct'),
+                    ('chamsky', (), 'chamsky'),
+                )
+                for phase, before, transform in phases:
+                    prepared = _transformed(cfg, *before)
+                    results.append(dict(result, phase=phase, seconds=_timed(
+                        lambda: getattr(copy(prepared), transform)(), repeat
+                    )))
+
+                cnf = _transformed(cfg, 'chamsky')
+                cnf.cyk('')
+                terminals = sorted(cfg.terminals - {cfg.null_character})
+                rng = random.Random(seed)
+                for length in input_lengths[preset]:
+                    string = ''.join(rng.choice(terminals) for _ in range(length))
+                    results.append(dict(result, phase='cyk', input_length=length, seconds=_timed(
+                        lambda: cnf.cyk(string), repeat
+                    )))
+    finally:
+        normal_form_cache.maxsize = maxsize
+
+    return results
+
+
+def _key(result):
+    return result['grammar'], result['size'], result['phase'], result.get('input_length')
+
+
+def compare(results, baseline):
+    """
+    Returns lines of the time ratio of every result to the same benchmark of baseline results.
+    """
+    baseline = {_key(result): result['seconds'] for result in baseline}
+    lines = []
+    for result in results:
+        old = baseline.get(_key(result))
+        if old:
+            lines.append('{:<16}{:>6}  {:<18}{:>6}  {:.2f}x'.format(
+                result['grammar'], result['size'], result['phase'], result.get('input_length') or '',
+                result['seconds'] / old
+            ))
+
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyCFG benchmarks")
+    parser.add_argument('--quick', action='store_true', help="run small sizes only")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark")
+    parser.add_argument('--seed', type=int, default=0, help="seed of random input strings")
+    parser.add_argument('--grammar', action='append', choices=sorted(generators),
+                        help="run only this grammar generator, can be repeated")
+    parser.add_argument('--output', help="JSON file to write results to, defaults to stdout")
+    parser.add_argument('--compare', help="JSON file of earlier results to compare with")
+    args = parser.parse_args(argv)
+
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': run('quick' if args.quick else 'full', args.repeat, args.seed, args.grammar),
+    }
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as file:
+            print('\n'.join(compare(report['results'], json.load(file)['results'])), file=sys.stderr)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,8 +6,27 @@ Author : Hamidreza Mahdavipanah
 Repository: http://github.com/mahdavipanah/pyCFG
 License : MIT License
 """
+import functools
+import hashlib
+import os
+import random
 import re
-from copy import deepcopy, copy
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from copy import copy
+from itertools import islice, tee
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def strings_contain_each_other(first_str, second_str):
@@ -29,6 +48,64 @@ def strings_contain_each_other(first_str, second_str):
     return are_containing, first_str, second_str
 
 
+def find_containments(strings):
+    """
+    Finds the strings that contain each other.
+
+    Returns the set of (the string that includes, the string that is included) pairs. All strings
+    are searched at once with an Aho-Corasick automaton, so it runs in time linear in the total
+    length of strings plus the number of matches.
+    """
+    strings = list(strings)
+
+    # goto[state]: transitions of the trie, output[state]: string that ends at state
+    goto = [{}]
+    output = [None]
+    for string in strings:
+        state = 0
+        for char in string:
+            if char not in goto[state]:
+                goto[state][char] = len(goto)
+                goto.append({})
+                output.append(None)
+            state = goto[state][char]
+        output[state] = string
+
+    # fail[state]: longest proper suffix state, dict_link[state]: longest suffix state with an output
+    fail = [0] * len(goto)
+    dict_link = [0] * len(goto)
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, child in goto[state].items():
+            queue.append(child)
+            if state:
+                suffix = fail[state]
+                while suffix and char not in goto[suffix]:
+                    suffix = fail[suffix]
+                fail[child] = goto[suffix].get(char, 0)
+            dict_link[child] = fail[child] if output[fail[child]] is not None else dict_link[fail[child]]
+
+    containments = set()
+    for string in strings:
+        state = 0
+        for char in string:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            match = state if output[state] is not None else dict_link[state]
+            while match:
+                if output[match] != string:
+                    containments.add((string, output[match]))
+                match = dict_link[match]
+
+    if output[0] is not None:
+        # The empty string ends at the root, which the matches above never report
+        containments.update((string, '') for string in strings if string)
+
+    return containments
+
+
 def string_contains_space(string):
     """
     Returns true if string contains space, false otherwise.
@@ -45,386 +122,2906 @@ def re_escaped(it):
         yield re.escape(i)
 
 
-class RuleNode(object):
-    def __init__(self, value=None):
-        self.value = value
-
-    def children(self, pattern):
-        for i in range(len(self.value)):
-            if pattern.fullmatch(self.value[i][0]) and not self.value[i][1]:
-                first_value = deepcopy(self.value)
-                first_value[i][1] = True
-                second_value = deepcopy(self.value)
-                del second_value[i]
-                return RuleNode(first_value), RuleNode(second_value)
+def chunks(it, size):
+    """
+    Yields lists of up to size consecutive items of passed iterable.
+    """
+    it = iter(it)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
 
 
-class CFG(object):
+class Tokenizer(object):
     """
-    Context free grammar (CFG) class
+    Deterministic longest-match tokenizer over a set of symbols.
+
+    Symbols are stored in a trie, and at every position the longest symbol that starts there is
+    taken, so a string is split in time linear in its length for a given longest symbol.
     """
 
-    def __init__(self,
-                 variables=None,
-                 terminals=None,
-                 rules=None,
-                 start_variable='S',
-                 null_character='λ'):
+    def __init__(self, symbols):
         """
         Initialize method
 
         Parameters
-            variables (optional): grammar's variables set.
-            terminals: grammar's terminals set
-            rules:  grammar's rules
-            start_variable (optional, defaults to 'S'): grammar's start variable
-            null_character (optional, defaults to 'λ'): grammar's null character
+            symbols: dict of symbol to its id
         """
+        # Every trie node is a dict of characters to child nodes, None key holds the id of the
+        # symbol that ends at the node.
+        self.trie = {}
+        for symbol, symbol_id in symbols.items():
+            self.add(symbol, symbol_id)
 
-        if variables is None:
-            variables = set()
-        elif hasattr(variables, '__iter__'):
-            variables = {*variables}
-        else:
-            raise TypeError(
-                "CFG variables must be a iterable, not {}".format(type(variables).__name__)
-            )
-
-        if isinstance(rules, dict):
-            variables |= {*rules}
-            rules = {
-                (var, var_rule)
-                for var, var_rules in rules.items()
-                for var_rule in var_rules
-            }
-        elif hasattr(rules, '__iter__'):
-            rules = {*rules}
-        else:
-            raise TypeError(
-                "CFG rules must be a collection or a dict, not {}".format(type(rules).__name__)
-            )
-
-        if isinstance(terminals, set):
-            terminals = terminals
-        elif hasattr(terminals, '__iter__'):
-            terminals = {*terminals}
-        else:
-            raise TypeError(
-                "CFG variables must be a iterable, not {}".format(type(variables).__name__)
-            )
-
-        self.variables = variables
-        self.terminals = terminals
-        self.start_variable = start_variable
-        self.null_character = null_character
-        self.accepts_null = None
-        self.rules = rules
-        self._is_chamsky = None
-        self._cnf = None
-
-    @property
-    def variables(self):
+    def add(self, symbol, symbol_id):
         """
-        Grammar's variables set property getter
+        Adds a symbol to the tokenizer.
         """
-        return self._variables
+        node = self.trie
+        for char in symbol:
+            node = node.setdefault(char, {})
+        node[None] = symbol_id
 
-    @variables.setter
-    def variables(self, new_variables):
+    def tokenize(self, string):
         """
-        Grammar's variables set property setter
+        Returns the list of symbol ids of passed string, or None if it cannot be split into symbols.
         """
-        if type(new_variables) is not set:
-            raise TypeError("CFG variables must be a set, not '{}'".format(type(new_variables).__name__))
+        tokens = []
+        pos = 0
+        while pos < len(string):
+            node = self.trie
+            match = None
+            i = pos
+            while i < len(string):
+                node = node.get(string[i])
+                if node is None:
+                    break
+                i += 1
+                if None in node:
+                    match = node[None], i
+            if not match:
+                return None
+            tokens.append(match[0])
+            pos = match[1]
 
-        for variable in new_variables:
-            if type(variable) is not str:
-                raise TypeError("CFG variables must be strings, not '{}'".format(type(variable).__name__))
+        return tokens
 
-        for variable in new_variables:
-            if string_contains_space(variable):
-                raise ValueError("Variables cannot contain white spaces : '{}'".format(variable))
 
-        new_variables_list = list(new_variables)
-        for i in range(len(new_variables_list) - 1):
-            for j in range(i + 1, len(new_variables_list)):
-                contain_each_other, first_str, second_str = strings_contain_each_other(new_variables_list[i],
-                                                                                       new_variables_list[j])
-                if contain_each_other:
-                    raise ValueError("Variables cannot contain each other, '{}' contains '{}'"
-                                     .format(first_str, second_str))
+"""
+State of the worker processes of CompiledCNF.accepts_many, the compiled grammar is sent to each
+worker once by the pool initializer, or loaded by each worker from the file it was loaded from.
+"""
+_worker_compiled = None
 
-        self._variables = frozenset(new_variables)
-        self._is_chamsky = None
-        self._cnf = None
-        self.accepts_null = None
+
+def _init_worker(compiled, file=None):
+    global _worker_compiled
+    if file is not None:
+        path, checksum = file
+        compiled = CompiledCNF.load(path)
+        if compiled._file != file:
+            raise ValueError("Compiled grammar file '{}' changed since it was loaded".format(path))
+    _worker_compiled = compiled
+
+
+def _worker_accepts_chunk(strings):
+    return _worker_compiled._accepts_chunk(strings)
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class GrammarCache(object):
+    """
+    Process-wide LRU cache of normalized grammars.
+
+    Entries are keyed by a canonical hash of a grammar's content, so structurally identical
+    grammars share the results of simplify() and chamsky() whichever CFG instance computed them.
+    Cached grammars are immutable snapshots whose frozensets are shared by the grammars that
+    restore them.
+    """
+
+    def __init__(self, maxsize=256):
+        """
+        Initialize method
+
+        Parameters
+            maxsize (optional, defaults to 256): maximum number of cached grammars, None means no
+                limit and 0 disables the cache
+        """
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
 
     @property
-    def terminals(self):
+    def maxsize(self):
         """
-        Grammar's terminals set property getter
+        Maximum number of cached grammars property getter
         """
-        return self._terminals
+        return self._maxsize
 
-    @terminals.setter
-    def terminals(self, new_terminals):
+    @maxsize.setter
+    def maxsize(self, new_maxsize):
         """
-        Grammar's terminals set property setter
+        Maximum number of cached grammars property setter
         """
-        if type(new_terminals) is not set:
-            raise TypeError("CFG terminals must be a set, not '{}'".format(type(new_terminals).__name__))
+        if new_maxsize is not None and (type(new_maxsize) is not int or new_maxsize < 0):
+            raise ValueError("Cache maxsize must be a non-negative int or None")
 
-        for terminal in new_terminals:
-            if type(terminal) is not str:
-                raise TypeError("CFG terminals must be strings, not '{}'".format(type(terminal).__name__))
+        with self._lock:
+            self._maxsize = new_maxsize
+            self._evict()
 
-        for terminal in new_terminals:
-            if string_contains_space(terminal):
-                raise ValueError("Variables cannot contain white spaces : '{}'".format(terminal))
+    def _evict(self):
+        while self._maxsize is not None and len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
 
-        new_terminals_list = list(new_terminals)
-        for i in range(len(new_terminals_list) - 1):
-            for j in range(i + 1, len(new_terminals_list)):
-                contain_each_other, first_str, second_str = strings_contain_each_other(new_terminals_list[i],
-                                                                                       new_terminals_list[j])
-                if contain_each_other:
-                    raise ValueError("Terminals cannot contain each other, '{}' contains '{}'"
-                                     .format(first_str, second_str))
+    def get(self, key):
+        """
+        Returns the cached snapshot of key, or None.
+        """
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
 
-        self._terminals = frozenset(new_terminals)
-        self._is_chamsky = None
-        self._cnf = None
-        self.accepts_null = None
+            return snapshot
 
-    @property
-    def rules(self):
+    def put(self, key, snapshot):
         """
-        Grammar's rules property getter
+        Caches a snapshot for key.
         """
-        return self._rules
+        with self._lock:
+            self._entries[key] = snapshot
+            self._entries.move_to_end(key)
+            self._evict()
 
-    @rules.setter
-    def rules(self, new_rules):
+    def info(self):
         """
-        Grammar's rules property setter
+        Returns the CacheInfo of hits, misses, maximum and current size of the cache.
         """
-        if type(new_rules) is not set:
-            raise TypeError("CFG rules must be a set, not '{}'".format(type(new_rules).__name__))
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self._maxsize, len(self._entries))
 
-        for rule in new_rules:
-            if type(rule) is not tuple:
-                raise TypeError("CFG rules must be 2-tuples, not '{}'".format(type(rule).__name__))
-            if len(rule) != 2:
-                raise TypeError("CFG rules must be 2-tuples")
-            if type(rule[0]) is not str or type(rule[1]) is not str:
-                raise TypeError("CFG rules must contain strings")
-            if string_contains_space(rule[0]) or string_contains_space(rule[1]):
-                raise ValueError("Rule cannot contain white spaces : '{} -> {}'".format(*rule))
+    def clear(self):
+        """
+        Removes all cached grammars and resets the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
 
-        pattern = re.compile('({})+'.format('|'.join(re_escaped(self.variables | self.terminals))))
 
-        for rule in new_rules:
-            if rule[0] not in self.variables:
-                raise ValueError("Unknown Variable '{p0}' in '{p0} -> {p1}'".format(
-                    p0=rule[0],
-                    p1=rule[1]
-                ))
-            if not pattern.fullmatch(rule[1]):
-                raise ValueError("Rule must contain combination of variables and terminals : '{} -> {}'".format(*rule))
-            if rule[1].count(self.null_character) and rule[1] != self.null_character:
-                raise ValueError("Rule cannot combine null character with variables and terminals : '{} -> {}'".format(
-                    *rule))
+# Cache of the results of CFG.simplify() and CFG.chamsky()
+normal_form_cache = GrammarCache()
 
-        self._rules = frozenset(new_rules)
-        self._is_chamsky = None
-        self._cnf = None
-        self.accepts_null = None
-        if (self.start_variable, self.null_character) in self._rules:
-            self.accepts_null = True
 
-    @property
-    def start_variable(self):
+PhaseStats = namedtuple('PhaseStats', ['name', 'seconds', 'variables_before', 'variables_after',
+                                       'rules_before', 'rules_after'])
+CYKStats = namedtuple('CYKStats', ['length', 'accepted', 'seconds', 'cells_filled', 'rule_probes',
+                                   'split_points', 'peak_chart_bytes'])
+
+
+class Stats(object):
+    """
+    Instrumentation records of a grammar, enabled by setting CFG.stats.
+
+    Every transform adds a PhaseStats record with its wall time and the variable and rule counts
+    before and after it, nested transforms (e.g. simplify() in chamsky()) add their own records
+    before the enclosing one. Every CFG.cyk() call adds a CYKStats record with:
+        cells_filled: number of chart cells that were calculated
+        rule_probes: number of rule lookups, whose unit depends on the backend: rule bodies found at
+            split points ('sets'), distinct joined cell pairs ('bitset') or rule bodies checked at
+            split points ('numpy'), plus one terminal lookup per token
+        split_points: number of split points that were tried
+        peak_chart_bytes: largest memory used by the chart
+    The check runs on the backend passed to cyk() and only it is timed, counters are taken from
+    its chart afterwards.
+    """
+
+    def __init__(self, callback=None):
         """
-        Grammar's start_variable property getter
+        Initialize method
+
+        Parameters
+            callback (optional): function that is called with every new record
         """
-        return self._start_variable
+        self.phases = []
+        self.cyk = []
+        self.callback = callback
 
-    @start_variable.setter
-    def start_variable(self, new_start_variable):
+    def record(self, record):
         """
-        Grammar's start_variable property setter
+        Adds a PhaseStats or CYKStats record.
         """
-        if type(new_start_variable) is not str:
-            raise TypeError("CFG start variable must be string, not '{}'".format(type(new_start_variable).__name__))
-
-        if new_start_variable not in self.variables:
-            raise ValueError("Start variable must be in variables set")
+        if isinstance(record, PhaseStats):
+            self.phases.append(record)
+        else:
+            self.cyk.append(record)
 
-        self._start_variable = new_start_variable
-        self._is_chamsky = None
-        self._cnf = None
-        self.accepts_null = None
+        if self.callback:
+            self.callback(record)
 
-    @property
-    def null_character(self):
+    @contextmanager
+    def phase(self, cfg, name):
         """
-        Grammar's null_character property getter
+        Records the wall time and the sizes of cfg around the with block as phase name.
         """
-        return self._null_character
-
-    @null_character.setter
-    def null_character(self, new_null_character):
+        variables_before, rules_before = len(cfg._variable_ids), len(cfg._rules)
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+        self.record(PhaseStats(name, seconds, variables_before, len(cfg._variable_ids), rules_before,
+                               len(cfg._rules)))
+
+    def clear(self):
         """
-        Grammar's null_character property setter
+        Removes all records.
         """
-        if type(new_null_character) is not str:
-            raise TypeError("CFG null character must be string, not '{}'".format(type(new_null_character).__name__))
+        self.phases.clear()
+        self.cyk.clear()
 
-        if new_null_character not in self.terminals:
-            raise ValueError("Null character must be in terminals set")
 
-        self._null_character = new_null_character
-        self._is_chamsky = None
-        self._cnf = None
-        self.accepts_null = None
+def _instrumented(transform):
+    """
+    Records a PhaseStats of every call of a CFG transform method when the grammar has stats.
+    """
+    @functools.wraps(transform)
+    def wrapper(self, *args, **kwargs):
+        if self.stats is None:
+            return transform(self, *args, **kwargs)
 
-    def remove_null_rules(self):
-        """
-        Removes null rules from grammar.
-        """
-        nullable_vars = {rule[0] for rule in self.rules if rule[1] == self.null_character}
+        with self.stats.phase(self, transform.__name__):
+            return transform(self, *args, **kwargs)
 
-        if not nullable_vars:
-            return
+    return wrapper
 
-        while True:
-            is_nullable = re.compile('({})+'.format('|'.join(re_escaped(nullable_vars))))
-            new_nullable_vars = {rule[0] for rule in self.rules if is_nullable.fullmatch(rule[1])}
-            new_set = nullable_vars | new_nullable_vars
-            if new_set == nullable_vars:
-                break
-            nullable_vars = new_set
 
-        contains_nullable = re.compile('({})'.format('|'.join(re_escaped(nullable_vars))))
+class CompiledCNF(object):
+    """
+    Index of a grammar in Chamsky normal form (CNF) that is used by CYK algorithm.
 
-        new_rules = set()
+    Binary rules are indexed by their body, so every chart cell is filled by joining the variables
+    that are actually present in its two sub-cells instead of probing every rule of the grammar.
 
-        for rule in self.rules:
-            if rule[1] == self.null_character:
-                continue
-            splits = contains_nullable.split(rule[1])
-            if splits[0] != rule[1]:
-                splits = [[x, False] for x in splits if x != '']
-
-                def tree_search(node):
-                    if not node.value:
-                        return
-                    children = node.children(contains_nullable)
-                    if not children:
-                        new_rules.add((rule[0], (''.join((val[0] for val in node.value)))))
-                    else:
-                        for child in children:
-                            tree_search(child)
+    Chart backends:
+        'sets': every cell is a set of variable ids.
+        'bitset': every cell is an int bitmask over dense variable indexes. Cells are stored in
+            arrays of machine words when the grammar has at most 64 variables.
+        'numpy': the chart is a boolean tensor of shape (n, n, |V|) and every span length is filled
+            at once for all start positions. Falls back to 'sets' when NumPy is not installed.
+    """
 
-                tree_search(RuleNode(splits))
-            new_rules.add(rule)
+    backends = ('sets', 'bitset', 'numpy')
 
-        self._rules = frozenset(new_rules)
+    def __init__(self, cfg):
+        """
+        Initialize method
+
+        Parameters
+            cfg: grammar in Chamsky normal form
+        """
+        self._index(cfg._symbols, cfg._variable_ids, cfg._terminal_ids, cfg._rules,
+                    cfg._symbol_ids[cfg.start_variable], cfg.null_character, cfg.accepts_null)
 
-    def _var_none_unit_rules(self, var):
-        is_unit_rule = re.compile('({})'.format('|'.join(re_escaped(self.variables))))
-        return {rule[1] for rule in self.rules
-                if rule[0] == var and
-                not is_unit_rule.fullmatch(rule[1])}
+    def _index(self, symbols, variables, terminals, rules, start_variable, null_character, accepts_null):
+        """
+        Builds the indexes of a grammar in Chamsky normal form.
 
-    def _var_unit_rules(self, var):
-        return {rule[1] for rule in self.rules if rule[0] == var} - self._var_none_unit_rules(var)
+        Parameters
+            symbols: sequence of symbol strings indexed by their ids
+            variables: iterable of variable ids
+            terminals: iterable of terminal ids
+            rules: iterable of (head id, body ids tuple) pairs
+            start_variable: id of the start variable
+            null_character: null character string
+            accepts_null: whether the grammar accepts the empty string
+        """
+        self.symbols = tuple(symbols)
+        self.symbol_ids = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.terminals = frozenset(terminals)
+        self.tokenizer = Tokenizer({self.symbols[terminal]: terminal for terminal in self.terminals})
+        self.start_variable = start_variable
+        self.null_character = null_character
+        self.accepts_null = bool(accepts_null)
+
+        terminal_heads = {}
+        binary_heads = {}
+        right_variables = {}
+        for head, body in rules:
+            if len(body) == 1:
+                terminal_heads.setdefault(body[0], set()).add(head)
+            elif len(body) == 2:
+                binary_heads.setdefault(body, set()).add(head)
+                right_variables.setdefault(body[0], set()).add(body[1])
+
+        self.terminal_heads = {terminal: frozenset(heads) for terminal, heads in terminal_heads.items()}
+        self.binary_heads = {body: frozenset(heads) for body, heads in binary_heads.items()}
+        self.right_variables = {var: frozenset(vars) for var, vars in right_variables.items()}
 
-    def remove_unit_rules(self):
         """
-        Removes unit rules from grammar.
+        Bitset index
+        """
+        self.variables = tuple(sorted(variables))
+        bits = {var: 1 << i for i, var in enumerate(self.variables)}
+
+        def mask(vars):
+            result = 0
+            for var in vars:
+                result |= bits[var]
+            return result
+
+        self.start_mask = bits.get(self.start_variable, 0)
+        self.terminal_masks = {terminal: mask(heads) for terminal, heads in self.terminal_heads.items()}
+        # right_masks[i]: variables that can follow the i-th variable in a binary rule
+        # right_heads[i]: (right variable mask, heads mask) pairs of the i-th variable's binary rules
+        self.right_masks = [0] * len(self.variables)
+        self.right_heads = [[] for _ in self.variables]
+        for (left_var, right_var), heads in self.binary_heads.items():
+            self.right_masks[self.variables.index(left_var)] |= bits[right_var]
+            self.right_heads[self.variables.index(left_var)].append((bits[right_var], mask(heads)))
+
+        self._numpy_cache = None
+        self._sampler = None
+        # (path, checksum) of the file the grammar was loaded from
+        self._file = None
+
+    # Binary file format, all integers are unsigned 32-bit little-endian:
+    #   header: magic, version, flags, start variable, counts of symbols, variables, terminals,
+    #       terminal rules and binary rules, byte length of the string table, CRC-32 of the payload
+    #   payload: symbol offsets into the string table (symbols and the null character), variable
+    #       ids, terminal ids, (head, terminal) pairs, (head, left, right) triples and the UTF-8
+    #       string table
+    file_magic = b'PYCFGCNF'
+    file_version = 1
+    _file_header = struct.Struct('<8s10I')
+
+    def save(self, path):
         """
+        Saves the compiled grammar to a binary file, that can be loaded by CompiledCNF.load().
 
-        def get_related_unit_rules(var, var_related_unit_rules):
-            prev_related_unit_rules = copy(var_related_unit_rules)
-            var_unit_rules = self._var_unit_rules(var)
-            var_related_unit_rules |= var_unit_rules
-            for unit_var in var_unit_rules - prev_related_unit_rules:
-                get_related_unit_rules(unit_var, var_related_unit_rules)
+        Parameters
+            path: path of the file
+        """
+        strings = self.symbols + (self.null_character,)
+        offsets = array('I', [0])
+        table = bytearray()
+        for string in strings:
+            table += string.encode('utf-8')
+            offsets.append(len(table))
+
+        terminal_rules = array('I')
+        for terminal, heads in sorted(self.terminal_heads.items()):
+            for head in sorted(heads):
+                terminal_rules.extend((head, terminal))
+
+        binary_rules = array('I')
+        for (left_var, right_var), heads in sorted(self.binary_heads.items()):
+            for head in sorted(heads):
+                binary_rules.extend((head, left_var, right_var))
+
+        arrays = (offsets, array('I', self.variables), array('I', sorted(self.terminals)),
+                  terminal_rules, binary_rules)
+        if sys.byteorder == 'big':
+            for ids in arrays:
+                ids.byteswap()
+        payload = b''.join(ids.tobytes() for ids in arrays) + bytes(table)
+
+        header = self._file_header.pack(
+            self.file_magic, self.file_version, int(self.accepts_null), self.start_variable,
+            len(self.symbols), len(self.variables), len(arrays[2]), len(terminal_rules) // 2,
+            len(binary_rules) // 3, len(table), zlib.crc32(payload)
+        )
+
+        with open(path, 'wb') as file:
+            file.write(header)
+            file.write(payload)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a compiled grammar saved by CompiledCNF.save().
 
-        related_unit_rules = dict([(var, set()) for var in self.variables])
+        The rules are read as they were saved, so the grammar is neither parsed nor normalized
+        again, but the lookup tables are rebuilt in memory by every process that loads the file.
+        accepts_many() workers load the file themselves instead of receiving a pickled copy of the
+        grammar.
 
-        for var in self.variables:
-            get_related_unit_rules(var, related_unit_rules[var])
-            related_unit_rules[var] -= {var}
+        Parameters
+            path: path of the file
+        """
+        with open(path, 'rb') as file:
+            data = memoryview(file.read())
+        if len(data) < cls._file_header.size:
+            raise ValueError("'{}' is not a compiled grammar file".format(path))
+
+        (magic, version, flags, start_variable, symbols_count, variables_count, terminals_count,
+         terminal_rules_count, binary_rules_count, table_size, checksum) = cls._file_header.unpack_from(data)
+        if magic != cls.file_magic:
+            raise ValueError("'{}' is not a compiled grammar file".format(path))
+        if version != cls.file_version:
+            raise ValueError("Unsupported compiled grammar file version {}".format(version))
+
+        counts = (symbols_count + 2, variables_count, terminals_count, 2 * terminal_rules_count,
+                  3 * binary_rules_count)
+        payload = data[cls._file_header.size:]
+        if len(payload) != 4 * sum(counts) + table_size or zlib.crc32(payload) != checksum:
+            raise ValueError("Compiled grammar file '{}' is corrupted".format(path))
+
+        ids = payload[:4 * sum(counts)].cast('I')
+        if sys.byteorder == 'big':
+            ids = array('I', ids)
+            ids.byteswap()
+        table = payload[4 * sum(counts):]
+
+        arrays = []
+        for count in counts:
+            arrays.append(ids[:count])
+            ids = ids[count:]
+        offsets, variables, terminals, terminal_rules, binary_rules = arrays
+
+        strings = [str(table[offsets[i]:offsets[i + 1]], 'utf-8') for i in range(symbols_count + 1)]
+        rules = [(terminal_rules[i], (terminal_rules[i + 1],)) for i in range(0, len(terminal_rules), 2)]
+        rules += [(binary_rules[i], (binary_rules[i + 1], binary_rules[i + 2]))
+                  for i in range(0, len(binary_rules), 3)]
+
+        compiled = cls.__new__(cls)
+        compiled._index(strings[:-1], variables, terminals, rules, start_variable, strings[-1], flags & 1)
+        compiled._file = os.path.abspath(path), checksum
+        return compiled
+
+    def _file_unchanged(self):
+        """
+        Returns true if the grammar was loaded from a file that still has the same checksum.
+        """
+        if self._file is None:
+            return False
 
-        non_unit_rules = {(var, rule) for var in self.variables for rule in self._var_none_unit_rules(var)}
+        path, checksum = self._file
+        try:
+            with open(path, 'rb') as file:
+                header = file.read(self._file_header.size)
+        except OSError:
+            return False
 
-        for var in self.variables:
-            for related_var in related_unit_rules[var]:
-                non_unit_rules |= {(var, related_var_non_unit_rule) for related_var_non_unit_rule
-                                   in self._var_none_unit_rules(related_var)}
+        return len(header) == self._file_header.size and self._file_header.unpack(header)[-1] == checksum
 
-        self._rules = frozenset(non_unit_rules)
+    def tokenize(self, string):
+        """
+        Returns the list of terminal ids of passed string, or None if it contains an unknown symbol.
+        """
+        return self.tokenizer.tokenize(string)
 
-    def reduct(self):
+    def accepts(self, string, backend='sets', stats=None):
         """
-        Reducts grammar's rules.
+        Checks if grammar can generate passed string or not.
+
+        Parameters
+            string: the string to check
+            backend (optional, defaults to 'sets'): chart backend, one of CompiledCNF.backends
+            stats (optional): Stats that a CYKStats record of the check is added to. The passed
+                backend runs unchanged and is timed, its counters are taken from its final chart
+                afterwards
         """
+        if backend not in self.backends:
+            raise ValueError("Unknown CYK backend '{}'".format(backend))
+
+        if stats is None:
+            return self._accepts(string, backend)
+
+        charts = []
+        start = time.perf_counter()
+        accepted = self._accepts(string, backend, charts)
+        seconds = time.perf_counter() - start
+        if charts:
+            chart_backend, tokens, chart = charts[0]
+            counters = getattr(self, '_{}_counters'.format(chart_backend))(tokens, chart)
+            length = len(tokens)
+        else:
+            # Checks that end before a chart is filled
+            counters = [0, 0, 0, 0]
+            tokens = self.tokenize(string) if string not in ('', self.null_character) else None
+            length = len(tokens or ())
+        stats.record(CYKStats(length, accepted, seconds, *counters))
+        return accepted
+
+    def _accepts(self, string, backend, charts=None):
         """
-        Phase 1
+        Checks passed string with passed backend. If charts is a list, the (backend, tokens, chart)
+        of the check is appended to it.
         """
-        v1 = set()
-        while True:
-            v1_union_t = v1 | self.terminals
-            v1_union_t_pattern = re.compile('({})+'.format('|'.join(re_escaped(v1_union_t))))
-            prev_v1 = copy(v1)
-            for var in self.variables:
-                if {rule for rule in self.rules if rule[0] == var and v1_union_t_pattern.fullmatch(rule[1])}:
-                    v1.add(var)
-            if prev_v1 == v1:
-                break
-        p1 = {rule for rule in self.rules if v1_union_t_pattern.fullmatch(rule[1])}
+        if string == '':
+            return self.accepts_null
+
+        if string == self.null_character:
+            return False
+
+        tokens = self.tokenize(string)
+        if not tokens:
+            return False
+
+        if backend == 'bitset':
+            return self._accepts_bitset(tokens, charts)
+
+        if backend == 'numpy' and numpy is not None:
+            return self._accepts_numpy(tokens, charts)
+
+        n = len(tokens)
+        V = [[None] * n for _ in range(n)]
+        for i in range(n):
+            V[i][i] = self.terminal_heads.get(tokens[i], frozenset())
+
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                j = i + length - 1
+                V[i][j] = self._join(V, i, j)
 
-        is_rule = re.compile('({})'.format('|'.join(re_escaped((v1)))))
+        if charts is not None:
+            charts.append(('sets', tokens, V))
+        return self.start_variable in V[0][n - 1]
 
+    @staticmethod
+    def _chart_counts(n):
         """
-        Phase 2
+        Returns the numbers of chart cells and of split points of a string of n tokens, which every
+        backend fills and tries.
         """
+        return n * (n + 1) // 2, sum((n - length + 1) * (length - 1) for length in range(2, n + 1))
 
-        def get_related_vars(var, related_vars):
-            var_related_vars = set()
-            for rule in {rule[1] for rule in p1 if rule[0] == var}:
-                var_related_vars |= set(is_rule.findall(rule))
+    def _sets_counters(self, tokens, V):
+        """
+        Returns the [cells filled, rule probes, split points, peak chart bytes] counters of a chart
+        of sets. Rule probes are the binary rule bodies that are found for every split point.
+        """
+        n = len(tokens)
+        cells, splits = self._chart_counts(n)
+        probes = n
+        chart_bytes = sys.getsizeof(V) + n * sys.getsizeof(V[0])
+        for i in range(n):
+            chart_bytes += sys.getsizeof(V[i][i])
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                j = i + length - 1
+                for k in range(i, j):
+                    for left_var in V[i][k]:
+                        probes += len(self.right_variables.get(left_var, frozenset()).intersection(V[k + 1][j]))
+                # Cells are never freed, so the chart is largest when it is full
+                chart_bytes += sys.getsizeof(V[i][j])
+
+        return [cells, probes, splits, chart_bytes]
+
+    def _join(self, V, i, j):
+        """
+        Calculates V[i][j] from the sub-cells of every split point.
+        """
+        cell = set()
+        for k in range(i, j):
+            left = V[i][k]
+            right = V[k + 1][j]
+            if not left or not right:
+                continue
+            for left_var in left:
+                right_vars = self.right_variables.get(left_var)
+                if not right_vars:
+                    continue
+                for right_var in right_vars.intersection(right):
+                    cell |= self.binary_heads[(left_var, right_var)]
 
-            prev_related_vars = copy(related_vars)
-            related_vars |= var_related_vars
-            for related_var in var_related_vars - prev_related_vars:
-                get_related_vars(related_var, related_vars)
+        return cell
 
-        S_related_vars = set()
-        get_related_vars(self.start_variable, S_related_vars)
-        v1 = S_related_vars
-        v1.add(self.start_variable)
-        is_related_rule = re.compile('|'.join(re_escaped(v1)))
-        p1 -= {rule for rule in p1 if not is_related_rule.fullmatch(rule[0])}
+    def _accepts_bitset(self, tokens, charts=None):
+        """
+        CYK algorithm over a chart of bitmask cells.
 
-        terminals_pattern = re.compile('|'.join(re_escaped(self.terminals)))
-        t1 = {self.null_character}
-        for rule in p1:
-            t1 |= set(terminals_pattern.findall(rule[1]))
+        rows[i][l] holds the variables that generate the l + 1 tokens starting at i.
+        """
+        n = len(tokens)
+        if len(self.variables) <= 64:
+            rows = [array('Q', bytes(8 * (n - i))) for i in range(n)]
+        else:
+            rows = [[0] * (n - i) for i in range(n)]
+        for i in range(n):
+            rows[i][0] = self.terminal_masks.get(tokens[i], 0)
+
+        joins = {}
+        join_masks = self._join_masks
+        for length in range(2, n + 1):
+            for i in range(n - length + 1):
+                row = rows[i]
+                cell = 0
+                for k in range(1, length):
+                    left = row[k - 1]
+                    if not left:
+                        continue
+                    right = rows[i + k][length - k - 1]
+                    if not right:
+                        continue
+                    key = (left, right)
+                    if key in joins:
+                        cell |= joins[key]
+                    else:
+                        cell |= joins.setdefault(key, join_masks(left, right))
+                row[length - 1] = cell
 
-        self._variables = frozenset(v1)
-        self._rules = frozenset(p1)
-        self._terminals = frozenset(t1)
+        if charts is not None:
+            charts.append(('bitset', tokens, (rows, joins)))
+        return bool(rows[0][n - 1] & self.start_mask)
 
-    def simplify(self):
+    def _bitset_counters(self, tokens, chart):
         """
-        Simplifies the grammar.
+        Returns the counters of a bitset chart. Rule probes are the terminal lookups and the distinct
+        pairs of cells whose variables were joined through the binary rules.
         """
-        self.remove_null_rules()
+        rows, joins = chart
+        cells, splits = self._chart_counts(len(tokens))
+        chart_bytes = sys.getsizeof(rows) + sum(sys.getsizeof(row) for row in rows) + sys.getsizeof(joins)
+        return [cells, len(tokens) + len(joins), splits, chart_bytes]
+
+    def accepts_many(self, strings, chunk_size=1024, jobs=1):
+        """
+        Checks a batch of strings and yields the results in input order.
+
+        Strings are read in chunks of chunk_size. Inside a chunk they are checked in the order of
+        their tokens, which is a depth-first walk over the trie of the chunk, so every string reuses
+        the chart cells of the prefix that it shares with the previous one.
+
+        When jobs is more than 1, chunks are checked by a pool of that many processes (None means
+        one per CPU). The compiled grammar is sent to every worker once, or loaded by every worker
+        if it was loaded from a file, and at most two chunks per worker are in flight, so strings
+        are still read lazily.
+        """
+        if jobs == 1:
+            for chunk in chunks(strings, chunk_size):
+                yield from self._accepts_chunk(chunk)
+            return
+
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+
+        initargs = (None, self._file) if self._file_unchanged() else (self,)
+        with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=initargs) as executor:
+            pending = deque()
+            for chunk in chunks(strings, chunk_size):
+                pending.append(executor.submit(_worker_accepts_chunk, chunk))
+                if len(pending) >= 2 * jobs:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+    def _accepts_chunk(self, strings):
+        results = [False] * len(strings)
+        tokenized = []
+        for index, string in enumerate(strings):
+            if string == '':
+                results[index] = self.accepts_null
+            elif string != self.null_character:
+                tokens = self.tokenize(string)
+                if tokens:
+                    tokenized.append((tokens, index))
+
+        tokenized.sort()
+        chart = BitsetChart(self)
+        for tokens, index in tokenized:
+            chart.reset(tokens)
+            results[index] = chart.accepts()
+
+        return results
+
+    def _numpy_tables(self):
+        """
+        Returns (terminal rows, left pairs, right pairs, pair heads) matrices of the binary rules.
+
+        With P distinct binary rule bodies, left pairs[B, p] and right pairs[C, p] are set when the
+        p-th body is BC and pair heads[p, A] is set when A -> BC is a rule.
+        """
+        if self._numpy_cache is None:
+            index = {var: i for i, var in enumerate(self.variables)}
+            bodies = sorted(self.binary_heads)
+
+            terminal_rows = {}
+            for terminal, heads in self.terminal_heads.items():
+                terminal_rows[terminal] = numpy.zeros(len(self.variables), dtype=bool)
+                terminal_rows[terminal][[index[head] for head in heads]] = True
+
+            left_pairs = numpy.zeros((len(self.variables), len(bodies)), dtype=numpy.float32)
+            right_pairs = numpy.zeros((len(self.variables), len(bodies)), dtype=numpy.float32)
+            pair_heads = numpy.zeros((len(bodies), len(self.variables)), dtype=numpy.float32)
+            for p, body in enumerate(bodies):
+                left_pairs[index[body[0]], p] = 1
+                right_pairs[index[body[1]], p] = 1
+                pair_heads[p, [index[head] for head in self.binary_heads[body]]] = 1
+
+            self._numpy_cache = terminal_rows, left_pairs, right_pairs, pair_heads
+
+        return self._numpy_cache
+
+    def _accepts_numpy(self, tokens, charts=None):
+        """
+        CYK algorithm over a boolean NumPy chart, V[i, l, A] is set when A generates the l + 1
+        tokens starting at i.
+
+        The projections of every cell on the rule bodies it can start or end are kept indexed by the
+        cell's start and end position, so the sub-cells of all split points of all spans of one
+        length are plain slices of them.
+        """
+        if self.start_variable not in self.variables:
+            return False
+
+        terminal_rows, left_pairs, right_pairs, pair_heads = self._numpy_tables()
+
+        n = len(tokens)
+        empty_row = numpy.zeros(len(self.variables), dtype=bool)
+        V = numpy.zeros((n, n, len(self.variables)), dtype=bool)
+        V[:, 0] = [terminal_rows.get(token, empty_row) for token in tokens]
+        # left_V[i, l]: bodies that the cell of start i and length l + 1 can start
+        # right_V[j, l]: bodies that the cell of end j and length l + 1 can end
+        left_V = numpy.zeros((n, n, left_pairs.shape[1]), dtype=bool)
+        right_V = numpy.zeros((n, n, right_pairs.shape[1]), dtype=bool)
+        left_V[:, 0] = V[:, 0] @ left_pairs > 0
+        right_V[:, 0] = V[:, 0] @ right_pairs > 0
+
+        for length in range(2, n + 1):
+            starts = n - length + 1
+            left = left_V[:starts, :length - 1]
+            right = right_V[length - 1:, length - 2::-1]
+            cells = (left & right).any(axis=1) @ pair_heads > 0
+            V[:starts, length - 1] = cells
+            left_V[:starts, length - 1] = cells @ left_pairs > 0
+            right_V[length - 1:, length - 1] = cells @ right_pairs > 0
+
+        if charts is not None:
+            charts.append(('numpy', tokens, (V, left_V, right_V)))
+        return bool(V[0, n - 1, self.variables.index(self.start_variable)])
+
+    def _numpy_counters(self, tokens, chart):
+        """
+        Returns the counters of a NumPy chart. Rule probes are the terminal lookups and the rule
+        bodies that are checked at every split point.
+        """
+        V, left_V, right_V = chart
+        cells, splits = self._chart_counts(len(tokens))
+        return [cells, len(tokens) + splits * left_V.shape[2], splits, V.nbytes + left_V.nbytes + right_V.nbytes]
+
+    def _join_masks(self, left, right):
+        """
+        Returns the mask of variables that derive a left cell variable followed by a right cell variable.
+        """
+        cell = 0
+        while left:
+            low_bit = left & -left
+            left ^= low_bit
+            i = low_bit.bit_length() - 1
+            if right & self.right_masks[i]:
+                for right_mask, heads in self.right_heads[i]:
+                    if right & right_mask:
+                        cell |= heads
+
+        return cell
+
+
+class BitsetChart(object):
+    """
+    CYK chart of bitmask cells that can be edited one token at a time.
+
+    rows[i][l] holds the variables that generate the l + 1 tokens starting at i. A cell only
+    depends on the tokens it spans, so editing the token at some position only refills the cells
+    that span that position. Appending a token only adds the cells that end at it, so the chart can
+    also be cut back to a prefix and extended again without touching the cells of the prefix.
+    """
+
+    def __init__(self, compiled):
+        """
+        Initialize method
+
+        Parameters
+            compiled: CompiledCNF of the grammar
+        """
+        self.compiled = compiled
+        self.tokens = []
+        self.rows = []
+        self._joins = {}
+
+    def _new_row(self, token):
+        row = array('Q') if len(self.compiled.variables) <= 64 else []
+        row.append(self.compiled.terminal_masks.get(token, 0))
+        return row
+
+    def truncate(self, n):
+        """
+        Keeps only the cells of the first n tokens.
+        """
+        del self.tokens[n:]
+        del self.rows[n:]
+        for i, row in enumerate(self.rows):
+            del row[n - i:]
+
+    def _fill(self, pos):
+        """
+        Fills the missing cells that span position pos, all rows after pos must be complete.
+        """
+        rows = self.rows
+        joins = self._joins
+        join_masks = self.compiled._join_masks
+        for j in range(pos, len(self.tokens)):
+            for i in range(pos, -1, -1):
+                row = rows[i]
+                length = j - i + 1
+                if len(row) >= length:
+                    continue
+                cell = 0
+                for k in range(1, length):
+                    left = row[k - 1]
+                    if not left:
+                        continue
+                    right = rows[i + k][length - k - 1]
+                    if not right:
+                        continue
+                    key = (left, right)
+                    if key in joins:
+                        cell |= joins[key]
+                    else:
+                        cell |= joins.setdefault(key, join_masks(left, right))
+                row.append(cell)
+
+    def insert(self, pos, token):
+        """
+        Inserts a token id at position pos.
+        """
+        self.tokens.insert(pos, token)
+        for i in range(pos):
+            del self.rows[i][pos - i:]
+        self.rows.insert(pos, self._new_row(token))
+        self._fill(pos)
+
+    def delete(self, pos):
+        """
+        Deletes the token at position pos.
+        """
+        del self.tokens[pos]
+        del self.rows[pos]
+        for i in range(pos):
+            del self.rows[i][pos - i:]
+        if pos < len(self.tokens):
+            self._fill(pos)
+
+    def append(self, token):
+        """
+        Appends a token id and fills the cells that end at it.
+        """
+        self.insert(len(self.tokens), token)
+
+    def extend(self, tokens):
+        """
+        Appends token ids one by one.
+        """
+        for token in tokens:
+            self.append(token)
+
+    def reset(self, tokens):
+        """
+        Makes the chart hold passed tokens, reusing the cells of the common prefix.
+        """
+        common = 0
+        while common < min(len(self.tokens), len(tokens)) and self.tokens[common] == tokens[common]:
+            common += 1
+        self.truncate(common)
+        self.extend(tokens[common:])
+
+    def accepts(self):
+        """
+        Returns true if the start variable generates all tokens of the chart.
+        """
+        return bool(self.rows) and bool(self.rows[0][-1] & self.compiled.start_mask)
+
+
+class IncrementalRecognizer(object):
+    """
+    Checks a string that is edited one symbol at a time.
+
+    The CYK chart of the string is kept between edits, and an edit at some position only refills
+    the chart cells that span that position.
+    """
+
+    def __init__(self, cfg, string=''):
+        """
+        Initialize method
+
+        Parameters
+            cfg: the grammar
+            string (optional, defaults to ''): initial string
+        """
+        self._compiled = cfg._compile()
+        self._chart = BitsetChart(self._compiled)
+        self._symbols = []
+        tokens = self._compiled.tokenize(string)
+        if tokens is None:
+            # The string contains an unknown symbol and can never be accepted, keep its characters
+            symbols = string
+        else:
+            symbols = [self._compiled.symbols[token] for token in tokens]
+        for symbol in symbols:
+            self.append(symbol)
+
+    def _token(self, symbol):
+        return self._compiled.symbol_ids.get(symbol)
+
+    @property
+    def string(self):
+        """
+        The string that is being checked.
+        """
+        return ''.join(self._symbols)
+
+    def __len__(self):
+        return len(self._symbols)
+
+    def insert(self, pos, symbol):
+        """
+        Inserts a terminal at position pos.
+        """
+        if not 0 <= pos <= len(self._symbols):
+            raise IndexError("Position {} is out of string".format(pos))
+
+        self._symbols.insert(pos, symbol)
+        self._chart.insert(pos, self._token(symbol))
+
+    def delete(self, pos):
+        """
+        Deletes the terminal at position pos.
+        """
+        if not 0 <= pos < len(self._symbols):
+            raise IndexError("Position {} is out of string".format(pos))
+
+        del self._symbols[pos]
+        self._chart.delete(pos)
+
+    def append(self, symbol):
+        """
+        Appends a terminal to the end of string.
+        """
+        self.insert(len(self._symbols), symbol)
+
+    def accepts(self):
+        """
+        Checks if grammar can generate the current string or not.
+        """
+        if not self._symbols:
+            return self._compiled.accepts_null
+
+        return self._chart.accepts()
+
+
+class EarleyGrammar(object):
+    """
+    Tables of a grammar that are used by Earley algorithm.
+
+    Earley algorithm works directly on grammar's own rules, so unlike CYK it does not need the
+    grammar to be converted to CNF. Null rules are handled by advancing over nullable variables
+    when they are predicted. Rules that contain a variable which generates no string are never
+    predicted, so every item of a non-empty Earley set can still be completed.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize method
+
+        Parameters
+            cfg: the grammar
+        """
+        self.symbols = cfg._symbols
+        self.symbol_ids = cfg._symbol_ids
+        self.tokenizer = cfg._terminal_tokenizer()
+        self.terminals = cfg._terminal_ids
+        self.variables = cfg._variable_ids
+        self.start_variable = cfg._symbol_ids[cfg.start_variable]
+        self.null_character = cfg.null_character
+        # Transforms that remove null rules keep the empty string in the language with this flag
+        self.accepts_null = bool(cfg.accepts_null)
+        self.nullable = cfg._nullable_vars()
+        generating = cfg._generating_vars()
+
+        self.rules = tuple(sorted(cfg._rules))
+        self.var_rules = {}
+        for i, (head, body) in enumerate(self.rules):
+            if all(symbol in generating or symbol not in self.variables for symbol in body):
+                self.var_rules.setdefault(head, []).append(i)
+
+    def tokenize(self, string):
+        """
+        Returns the list of terminal ids of passed string, or None if it contains an unknown symbol.
+        """
+        return self.tokenizer.tokenize(string)
+
+    def accepts(self, string):
+        """
+        Checks if grammar can generate passed string or not.
+        """
+        if string == self.null_character:
+            return False
+
+        tokens = self.tokenize(string)
+        if tokens is None:
+            return False
+
+        return self.recognize(tokens).is_complete()
+
+    def recognize(self, tokens):
+        """
+        Returns the EarleyRecognizer that has read passed token ids.
+        """
+        recognizer = EarleyRecognizer(self)
+        for token in tokens:
+            if not recognizer.feed(token):
+                break
+
+        return recognizer
+
+    def rule_str(self, rule):
+        """
+        Returns the (variable, body) string pair of a rule.
+        """
+        head, body = self.rules[rule]
+        if not body:
+            return self.symbols[head], self.null_character
+
+        return self.symbols[head], ''.join(self.symbols[symbol] for symbol in body)
+
+
+class EarleyRecognizer(object):
+    """
+    Earley chart of a string that is read one token at a time.
+
+    An item (rule, dot, origin) of sets[k] says that rule's body up to dot generates the tokens
+    from origin to k.
+    """
+
+    def __init__(self, grammar):
+        """
+        Initialize method
+
+        Parameters
+            grammar: EarleyGrammar of the grammar
+        """
+        self.grammar = grammar
+        self.tokens = []
+        self.sets = []
+        # waiting[k][X]: items of sets[k] that have X after their dot
+        self.waiting = []
+        self._scans = {}
+        self._add_set([(rule, 0, 0) for rule in grammar.var_rules.get(grammar.start_variable, ())])
+
+    def _add_set(self, items):
+        """
+        Adds a new set to the chart that contains passed items and every item they predict or complete.
+        """
+        k = len(self.sets)
+        rules = self.grammar.rules
+        var_rules = self.grammar.var_rules
+        nullable = self.grammar.nullable
+        variables = self.grammar.variables
+
+        seen = set(items)
+        items = list(seen)
+        waiting = {}
+        scans = {}
+        self.sets.append(items)
+        self.waiting.append(waiting)
+
+        def add(item):
+            if item not in seen:
+                seen.add(item)
+                items.append(item)
+
+        i = 0
+        while i < len(items):
+            rule, dot, origin = items[i]
+            i += 1
+            head, body = rules[rule]
+            if dot == len(body):
+                for waiting_rule, waiting_dot, waiting_origin in self.waiting[origin].get(head, ()):
+                    add((waiting_rule, waiting_dot + 1, waiting_origin))
+                continue
+
+            symbol = body[dot]
+            if symbol in variables:
+                waiting.setdefault(symbol, []).append((rule, dot, origin))
+                for predicted_rule in var_rules.get(symbol, ()):
+                    add((predicted_rule, 0, k))
+                if symbol in nullable:
+                    add((rule, dot + 1, origin))
+            else:
+                scans.setdefault(symbol, []).append((rule, dot + 1, origin))
+
+        self._scans = scans
+
+    def feed(self, token):
+        """
+        Reads the next token id. Returns false if no item of the chart can read it.
+        """
+        self.tokens.append(token)
+        self._add_set(self._scans.get(token, []))
+        return bool(self.sets[-1])
+
+    def is_viable(self):
+        """
+        Returns true if the tokens that are read so far are a prefix of some string of the language.
+        """
+        return bool(self.sets[-1])
+
+    def expected_tokens(self):
+        """
+        Returns the set of terminal ids that can be read next.
+        """
+        return set(self._scans)
+
+    def is_complete(self):
+        """
+        Returns true if the tokens that are read so far are generated by the start variable.
+        """
+        if not self.tokens and self.grammar.accepts_null:
+            return True
+
+        rules = self.grammar.rules
+        for rule, dot, origin in self.sets[-1]:
+            head, body = rules[rule]
+            if origin == 0 and head == self.grammar.start_variable and dot == len(body):
+                return True
+
+        return False
+
+
+PrefixStatus = namedtuple('PrefixStatus', ['viable', 'complete', 'expected'])
+PrefixStatus.__doc__ = """
+State of an online recognizer after reading some symbols.
+
+    viable: whether the symbols read so far are a prefix of some string of the language
+    complete: whether the symbols read so far are a string of the language
+    expected: frozenset of terminals that can come next without leaving the language's prefixes
+"""
+
+
+class OnlineRecognizer(object):
+    """
+    Recognizer that reads a string one terminal at a time, using Earley algorithm on grammar's rules.
+
+    After every terminal it can tell if the input can still be completed to a string of the
+    language, if it already is one, and which terminals may come next.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize method
+
+        Parameters
+            cfg: the grammar
+        """
+        self._grammar = cfg._earley_grammar()
+        self._symbols = cfg._symbols
+        self._earley = EarleyRecognizer(self._grammar)
+
+    def feed(self, symbol):
+        """
+        Reads the next terminal. Returns the PrefixStatus of the input read so far.
+        """
+        if self._earley.is_viable():
+            self._earley.feed(self._grammar.symbol_ids.get(symbol))
+
+        return self.status()
+
+    def status(self):
+        """
+        Returns the PrefixStatus of the input read so far.
+        """
+        return PrefixStatus(
+            self._earley.is_viable(),
+            self._earley.is_complete(),
+            frozenset(self._symbols[token] for token in self._earley.expected_tokens())
+        )
+
+
+class SymbolNode(object):
+    """
+    Node of a parse forest for a symbol that generates the tokens from start to end.
+
+    families is the list of (rule, ItemNode) alternatives of a variable node, where rule is a
+    (variable, body) string pair of grammar's own rules and the ItemNode is None for null rules.
+    Terminal nodes have no families.
+    """
+
+    def __init__(self, symbol, start, end):
+        self.symbol = symbol
+        self.start = start
+        self.end = end
+        self.families = []
+
+    def __repr__(self):
+        return 'SymbolNode({!r}, {}, {})'.format(self.symbol, self.start, self.end)
+
+
+class ItemNode(object):
+    """
+    Node of a parse forest for the first dot symbols of a rule's body that generate the tokens
+    from start to end.
+
+    families is the list of (left, right) alternatives, where left is the ItemNode of the first
+    dot - 1 symbols (None when dot is 1) and right is the SymbolNode of the last one.
+    """
+
+    def __init__(self, rule, dot, start, end):
+        self.rule = rule
+        self.dot = dot
+        self.start = start
+        self.end = end
+        self.families = []
+
+    def __repr__(self):
+        return 'ItemNode({!r}, {}, {}, {})'.format(self.rule, self.dot, self.start, self.end)
+
+
+class ParseForest(object):
+    """
+    Shared packed parse forest (SPPF) of a string, built from the backpointers of its Earley chart.
+
+    Every (symbol, start, end) and every (rule, dot, start, end) has exactly one node, shared by all
+    derivations that use it, so the forest of an ambiguous grammar stays polynomial in the length of
+    the string while the number of its derivations may be exponential. Derivations are in terms of
+    grammar's own rules.
+    """
+
+    def __init__(self, recognizer):
+        """
+        Initialize method
+
+        Parameters
+            recognizer: EarleyRecognizer that has read the whole string and completed it
+        """
+        grammar = recognizer.grammar
+        tokens = recognizer.tokens
+        item_sets = [set(items) for items in recognizer.sets]
+
+        # completed[(variable, start, end)]: rules of variable that generate the tokens from start to end
+        completed = {}
+        for end, items in enumerate(recognizer.sets):
+            for rule, dot, origin in items:
+                head, body = grammar.rules[rule]
+                if dot == len(body):
+                    completed.setdefault((head, origin, end), []).append(rule)
+
+        symbol_nodes = {}
+        item_nodes = {}
+        stack = []
+
+        def symbol_node(symbol, start, end):
+            key = (symbol, start, end)
+            if key not in symbol_nodes:
+                symbol_nodes[key] = SymbolNode(grammar.symbols[symbol], start, end)
+                if symbol in grammar.variables:
+                    stack.append((symbol_nodes[key], key))
+            return symbol_nodes[key]
+
+        def item_node(rule, dot, start, end):
+            key = (rule, dot, start, end)
+            if key not in item_nodes:
+                item_nodes[key] = ItemNode(grammar.rule_str(rule), dot, start, end)
+                stack.append((item_nodes[key], key))
+            return item_nodes[key]
+
+        self.root = symbol_node(grammar.start_variable, 0, len(tokens))
+
+        while stack:
+            node, key = stack.pop()
+            if isinstance(node, SymbolNode):
+                symbol, start, end = key
+                for rule in completed.get(key, ()):
+                    body_len = len(grammar.rules[rule][1])
+                    node.families.append((
+                        grammar.rule_str(rule),
+                        item_node(rule, body_len, start, end) if body_len else None
+                    ))
+                continue
+
+            rule, dot, start, end = key
+            symbol = grammar.rules[rule][1][dot - 1]
+            if symbol in grammar.variables:
+                splits = [k for k in range(start, end + 1) if (symbol, k, end) in completed]
+            elif end > start and tokens[end - 1] == symbol:
+                splits = [end - 1]
+            else:
+                splits = []
+
+            for k in splits:
+                if (rule, dot - 1, start) in item_sets[k]:
+                    node.families.append((
+                        item_node(rule, dot - 1, start, k) if dot > 1 else None,
+                        symbol_node(symbol, k, end)
+                    ))
+
+        if not tokens and grammar.accepts_null and not self.root.families:
+            # The empty string is only in the language through the grammar's accepts_null flag
+            self.root.families.append(((self.root.symbol, grammar.null_character), None))
+
+    def trees(self):
+        """
+        Yields the parse trees of the string one by one.
+
+        A tree is a (variable, children) tuple, where children is a tuple of trees and terminals.
+        Derivations that go around a cycle of the grammar (like A -> B, B -> A) back to a node they
+        are already deriving are skipped, so only finitely many trees are yielded.
+        """
+        return self._symbol_trees(self.root, frozenset())
+
+    def count_trees(self, stop_above=None):
+        """
+        Returns the number of parse trees of the string.
+
+        Counts are computed bottom-up over the forest with arbitrary-precision ints, so the time is
+        linear in the size of the forest whatever the number of trees is. Raises ValueError if the
+        string has infinitely many parse trees, which happens when a node of the forest can derive
+        itself.
+
+        Parameters
+            stop_above (optional): if passed, returns as soon as the count of some node exceeds it.
+                Every node is part of some parse tree, so the whole string then has more trees too.
+        """
+        counts = {}
+        stack = [(self.root, False)]
+        while stack:
+            node, children_counted = stack.pop()
+            if children_counted:
+                count = 0
+                if isinstance(node, SymbolNode):
+                    for rule, item in node.families:
+                        count += counts[item] if item else 1
+                else:
+                    for left, right in node.families:
+                        count += (counts[left] if left else 1) * counts[right]
+                counts[node] = count
+                if stop_above is not None and count > stop_above:
+                    return count
+                continue
+
+            if node in counts:
+                if counts[node] is None:
+                    raise ValueError("String has infinitely many parse trees")
+                continue
+
+            if not node.families:
+                counts[node] = 1
+                continue
+
+            counts[node] = None
+            stack.append((node, True))
+            if isinstance(node, SymbolNode):
+                children = [item for rule, item in node.families if item]
+            else:
+                children = [child for family in node.families for child in family if child]
+            for child in children:
+                if child in counts and counts[child] is None:
+                    raise ValueError("String has infinitely many parse trees")
+                stack.append((child, False))
+
+        return counts[self.root]
+
+    def _symbol_trees(self, node, path):
+        if not node.families:
+            if node.end - node.start == 1:
+                yield node.symbol
+            return
+
+        if node in path:
+            return
+
+        path = path | {node}
+        for rule, item in node.families:
+            if item is None:
+                yield node.symbol, ()
+                continue
+            for children in self._item_trees(item, path):
+                yield node.symbol, children
+
+    def _item_trees(self, node, path):
+        for left, right in node.families:
+            for left_children in (self._item_trees(left, path) if left else [()]):
+                for right_tree in self._symbol_trees(right, path):
+                    yield left_children + (right_tree,)
+
+
+"""
+End of input marker of LL(1) tables and FOLLOW sets of symbol ids.
+"""
+END_OF_INPUT = -1
+
+
+class LL1Table(object):
+    """
+    LL(1) parse table of a grammar.
+
+    table[(variable, terminal)] is the body of the only rule that can be applied when the variable
+    is on top of the stack and terminal is the next token. Strings are recognized in linear time.
+    """
+
+    def __init__(self, cfg, table):
+        """
+        Initialize method
+
+        Parameters
+            cfg: the grammar
+            table: dict of (variable id, terminal id or END_OF_INPUT) to rule body
+        """
+        self.tokenizer = cfg._terminal_tokenizer()
+        self.terminals = cfg._terminal_ids
+        self.start_variable = cfg._symbol_ids[cfg.start_variable]
+        self.null_character = cfg.null_character
+        self.accepts_null = bool(cfg.accepts_null)
+        self.table = table
+
+    def tokenize(self, string):
+        """
+        Returns the list of terminal ids of passed string, or None if it contains an unknown symbol.
+        """
+        return self.tokenizer.tokenize(string)
+
+    def accepts(self, string):
+        """
+        Checks if grammar can generate passed string or not.
+        """
+        if string == self.null_character:
+            return False
+
+        tokens = self.tokenize(string)
+        if tokens is None:
+            return False
+        if not tokens and self.accepts_null:
+            return True
+        tokens.append(END_OF_INPUT)
+
+        table = self.table
+        terminals = self.terminals
+        stack = [END_OF_INPUT, self.start_variable]
+        pos = 0
+        while stack:
+            symbol = stack.pop()
+            token = tokens[pos]
+            if symbol == END_OF_INPUT or symbol in terminals:
+                if symbol != token:
+                    return False
+                pos += 1
+            else:
+                body = table.get((symbol, token))
+                if body is None:
+                    return False
+                stack.extend(reversed(body))
+
+        return True
+
+
+def _derivable_heads(rules, base=frozenset()):
+    """
+    Returns the set of heads of rules whose body symbols are all in base or in the returned set,
+    such as the nullable variables (empty base) or the generating variables (terminals as base).
+
+    Every rule counts its body symbols that are not known yet, and a head is found when the count
+    of one of its rules drops to zero, so each occurrence of a symbol is visited once.
+    """
+    rules = list(rules)
+    remaining = []
+    occurrences = {}
+    found = set()
+    queue = []
+    for i, (head, body) in enumerate(rules):
+        count = 0
+        for symbol in body:
+            if symbol not in base:
+                count += 1
+                occurrences.setdefault(symbol, []).append(i)
+        remaining.append(count)
+        if not count and head not in found:
+            found.add(head)
+            queue.append(head)
+
+    while queue:
+        for i in occurrences.get(queue.pop(), ()):
+            remaining[i] -= 1
+            head = rules[i][0]
+            if not remaining[i] and head not in found:
+                found.add(head)
+                queue.append(head)
+
+    return found
+
+
+def _length_sum(first, second, limit):
+    """
+    Returns the bitmask of sums of lengths in two bitmasks of lengths, up to limit.
+    """
+    result = 0
+    while first:
+        lowest = first & -first
+        result |= second * lowest
+        first ^= lowest
+
+    return result & ((2 << limit) - 1)
+
+
+_ChartSet = namedtuple('_ChartSet', ['waiting', 'expected', 'completable', 'accepted', 'up'])
+
+
+class LanguageEnumerator(object):
+    """
+    Enumerates the strings of a grammar in Chamsky normal form by length, then lexicographically.
+
+    Lengths are counted in terminals. A length-indexed DP gives the lengths that every variable can
+    generate as a bitmask. Strings of a length are built terminal by terminal in lexicographic
+    order, keeping an Earley chart of the prefix, and a terminal is only taken if the chart can
+    still be completed to that length. So no dead end is explored and every string is produced
+    once, even by ambiguous grammars, while only the DP and the chart of the current prefix are kept.
+    """
+
+    def __init__(self, compiled):
+        """
+        Initialize method
+
+        Parameters
+            compiled: CompiledCNF of the grammar
+        """
+        self.compiled = compiled
+        self.start_variable = compiled.start_variable
+        self.terminal_rules = {}
+        for terminal, heads in compiled.terminal_heads.items():
+            for head in heads:
+                self.terminal_rules.setdefault(head, set()).add(terminal)
+
+        generating = _derivable_heads(
+            [(head, body) for body, heads in compiled.binary_heads.items() for head in heads] +
+            [(head, (terminal,)) for terminal, heads in compiled.terminal_heads.items() for head in heads],
+            compiled.terminals
+        )
+
+        # Rules with a variable that generates nothing can never be completed
+        self.binary_rules = {}
+        for (left_var, right_var), heads in compiled.binary_heads.items():
+            if left_var in generating and right_var in generating:
+                for head in heads:
+                    self.binary_rules.setdefault(head, []).append((left_var, right_var))
+
+        # Terminals cannot contain each other, so ordering strings by their terminals orders them
+        # as strings
+        self.terminals = sorted(compiled.terminal_heads, key=lambda terminal: compiled.symbols[terminal])
+        self.max_length = self._max_length() if self.start_variable in generating else 0
+        self.limit = 0
+        self.lengths = {}
+
+    def _max_length(self):
+        """
+        Returns the length of the longest string of the language, or None if it is infinite.
+        """
+        max_lengths = {}
+        on_path = set()
+        stack = [self.start_variable]
+        while stack:
+            var = stack[-1]
+            if var in max_lengths:
+                stack.pop()
+            elif var not in on_path:
+                on_path.add(var)
+                for rule in self.binary_rules.get(var, ()):
+                    for child in rule:
+                        if child in on_path:
+                            # The variable derives itself with more terminals
+                            return None
+                        if child not in max_lengths:
+                            stack.append(child)
+            else:
+                max_lengths[var] = max([1 if var in self.terminal_rules else 0] +
+                                       [max_lengths[left_var] + max_lengths[right_var]
+                                        for left_var, right_var in self.binary_rules.get(var, ())])
+                on_path.discard(var)
+                stack.pop()
+
+        return max_lengths[self.start_variable]
+
+    def _extend_lengths(self, length):
+        """
+        Makes sure that lengths[var] holds the bitmask of lengths up to length that var generates.
+        """
+        if length <= self.limit:
+            return
+
+        limit = max(length, 2 * self.limit, 8)
+        lengths = {var: 2 for var in self.terminal_rules}
+        changed = True
+        while changed:
+            changed = False
+            for head, rules in self.binary_rules.items():
+                mask = lengths.get(head, 0)
+                for left_var, right_var in rules:
+                    if left_var in lengths and right_var in lengths:
+                        mask |= _length_sum(lengths[left_var], lengths[right_var], limit)
+                if mask != lengths.get(head, 0):
+                    lengths[head] = mask
+                    changed = True
+
+        self.limit = limit
+        self.lengths = lengths
+
+    def strings(self, max_length=None):
+        """
+        Yields the non-empty strings of the language by length, then lexicographically.
+
+        Parameters
+            max_length (optional): length of the longest strings, None means no limit
+        """
+        length = 1
+        while max_length is None or length <= max_length:
+            if self.max_length is not None and length > self.max_length:
+                return
+
+            self._extend_lengths(length)
+            if self.lengths.get(self.start_variable, 0) >> length & 1:
+                yield from self._strings(length)
+            length += 1
+
+    def _chart_set(self, waiting, accepted, chart, length):
+        """
+        Completes a chart set with predictions and returns it as a _ChartSet.
+
+        waiting[var] holds the (head, right variable or None, origin) items that wait for var, and
+        up[var] the bitmask of lengths that the waiting items need after var.
+        """
+        position = len(chart)
+        lengths = self.lengths
+        up = {}
+        for var, items in waiting.items():
+            mask = 0
+            for head, right_var, origin in items:
+                after = 1 if head is None else chart[origin].up[head]
+                if right_var is not None:
+                    after = _length_sum(lengths.get(right_var, 0), after, length)
+                mask |= after
+            up[var] = mask
+
+        # Predicted items wait in this set, so their masks are propagated from their heads
+        predicted = set(waiting)
+        stack = list(waiting)
+        while stack:
+            head = stack.pop()
+            for left_var, right_var in self.binary_rules.get(head, ()):
+                waiting.setdefault(left_var, set()).add((head, right_var, position))
+                mask = up.get(left_var, 0) | _length_sum(lengths.get(right_var, 0), up[head], length)
+                if left_var not in predicted or mask != up[left_var]:
+                    up[left_var] = mask
+                    predicted.add(left_var)
+                    stack.append(left_var)
+
+        completable = 0
+        expected = set()
+        for var, mask in up.items():
+            completable |= _length_sum(lengths.get(var, 0), mask, length)
+            expected |= self.terminal_rules.get(var, set())
+
+        return _ChartSet(waiting, expected, completable, accepted, up)
+
+    def _scan(self, chart, terminal, length):
+        """
+        Returns the chart set after passed terminal.
+        """
+        position = len(chart) - 1
+        agenda = [(var, position) for var in chart[-1].waiting if terminal in self.terminal_rules.get(var, ())]
+        completed = set(agenda)
+        waiting = {}
+        accepted = False
+        while agenda:
+            var, origin = agenda.pop()
+            for head, right_var, item_origin in chart[origin].waiting[var]:
+                if right_var is not None:
+                    waiting.setdefault(right_var, set()).add((head, None, item_origin))
+                elif head is None:
+                    accepted = True
+                elif (head, item_origin) not in completed:
+                    completed.add((head, item_origin))
+                    agenda.append((head, item_origin))
+
+        return self._chart_set(waiting, accepted, chart, length)
+
+    def _strings(self, length):
+        """
+        Yields the strings of passed length in lexicographic order.
+        """
+        symbols = self.compiled.symbols
+        chart = []
+        chart.append(self._chart_set({self.start_variable: {(None, None, 0)}}, False, chart, length))
+        tokens = []
+        terminals = [iter(self.terminals)]
+        while terminals:
+            remaining = length - len(chart)
+            for terminal in terminals[-1]:
+                if terminal not in chart[-1].expected:
+                    continue
+
+                chart_set = self._scan(chart, terminal, length)
+                if remaining == 0:
+                    if chart_set.accepted:
+                        yield ''.join(symbols[token] for token in tokens + [terminal])
+                elif chart_set.completable >> remaining & 1:
+                    tokens.append(terminal)
+                    chart.append(chart_set)
+                    terminals.append(iter(self.terminals))
+                    break
+            else:
+                terminals.pop()
+                chart.pop()
+                if tokens:
+                    tokens.pop()
+
+
+class LanguageSampler(object):
+    """
+    Draws random strings of a given length from a grammar in Chamsky normal form.
+
+    counts[var][n] is the number of derivation trees of var with n terminals. A string is drawn top
+    down: every variable picks a rule and a split of its length with probability proportional to the
+    number of trees below it. So every derivation tree of the length is equally likely, which makes
+    every string equally likely when the grammar is not ambiguous. Only the counts are kept, that
+    is a number per variable and length.
+    """
+
+    def __init__(self, compiled):
+        """
+        Initialize method
+
+        Parameters
+            compiled: CompiledCNF of the grammar
+        """
+        self.compiled = compiled
+        self.start_variable = compiled.start_variable
+        self.terminal_rules = {}
+        for terminal, heads in compiled.terminal_heads.items():
+            for head in heads:
+                self.terminal_rules.setdefault(head, []).append(terminal)
+        for terminals in self.terminal_rules.values():
+            terminals.sort()
+
+        self.binary_rules = {}
+        for (left_var, right_var), heads in sorted(compiled.binary_heads.items()):
+            for head in heads:
+                self.binary_rules.setdefault(head, []).append((left_var, right_var))
+
+        self.limit = 1
+        self.counts = {var: [0, len(terminals)] for var, terminals in self.terminal_rules.items()}
+        for var, rules in self.binary_rules.items():
+            for symbol in (var,) + tuple(symbol for rule in rules for symbol in rule):
+                self.counts.setdefault(symbol, [0, 0])
+
+    def _extend_counts(self, length):
+        """
+        Makes sure that counts[var] holds the counts of lengths up to length.
+        """
+        counts = self.counts
+        for n in range(self.limit + 1, length + 1):
+            for var, var_counts in counts.items():
+                total = 0
+                for left_var, right_var in self.binary_rules.get(var, ()):
+                    left_counts = counts[left_var]
+                    right_counts = counts[right_var]
+                    for i in range(1, n):
+                        total += left_counts[i] * right_counts[n - i]
+                var_counts.append(total)
+        self.limit = max(self.limit, length)
+
+    def count(self, length):
+        """
+        Returns the number of derivation trees of the start variable with passed number of terminals.
+        """
+        if length < 0:
+            raise ValueError("Length must be a non-negative int, not {}".format(length))
+        if length == 0:
+            return int(self.compiled.accepts_null)
+
+        self._extend_counts(length)
+        return self.counts.get(self.start_variable, [0] * (length + 1))[length]
+
+    def _choice(self, var, length, rng):
+        """
+        Returns a random (left variable, right variable, left length) of var's binary rules, weighted
+        by the number of trees of that length.
+
+        Splits are tried from both ends in turn, so a split of i and length - i terminals is found
+        after about 2 * min(i, length - i) tries, and a whole draw takes O(n log n) tries at worst.
+        """
+        counts = self.counts
+        rules = self.binary_rules[var]
+        r = rng.randrange(counts[var][length])
+        for k in range(1, length // 2 + 1):
+            for i in ((k,) if 2 * k == length else (k, length - k)):
+                for left_var, right_var in rules:
+                    r -= counts[left_var][i] * counts[right_var][length - i]
+                    if r < 0:
+                        return left_var, right_var, i
+
+    def sample(self, length, k, rng):
+        """
+        Returns a list of k random strings of passed length.
+
+        Parameters
+            length: number of terminals of the strings
+            k: number of strings
+            rng: random.Random instance to draw with
+        """
+        if k < 0:
+            raise ValueError("Number of strings must be a non-negative int, not {}".format(k))
+        if not self.count(length):
+            raise ValueError("Language has no string of length {}".format(length))
+        if length == 0:
+            return [''] * k
+
+        symbols = self.compiled.symbols
+        strings = []
+        for _ in range(k):
+            tokens = []
+            stack = [(self.start_variable, length)]
+            while stack:
+                var, n = stack.pop()
+                if n == 1:
+                    # Terminal rules are the only derivations of length 1
+                    terminals = self.terminal_rules[var]
+                    tokens.append(symbols[terminals[rng.randrange(len(terminals))]])
+                else:
+                    left_var, right_var, i = self._choice(var, n, rng)
+                    stack.append((right_var, n - i))
+                    stack.append((left_var, i))
+            strings.append(''.join(tokens))
+
+        return strings
+
+
+class GrammarAnalysis(object):
+    """
+    Nullable, generating and reachable variables and unit closure of a grammar.
+
+    unit_closure[A] is the set of variables that A derives through unit rules, including A itself
+    and the rules that become unit rules when their nullable symbols are omitted.
+
+    Adding a rule updates the analyses incrementally, propagating only from the rule's head.
+    Removing a rule computes again only the analyses that the rule could have contributed to.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initialize method
+
+        Parameters
+            cfg: the grammar
+        """
+        self.variables = set(cfg._variable_ids)
+        self.terminals = cfg._terminal_ids
+        self.start_variable = cfg._symbol_ids[cfg.start_variable]
+        self.rules_by_head = {}
+        self.rules_by_symbol = {}
+        for rule in cfg._rules:
+            self._index(rule)
+
+        self.nullable = _derivable_heads(cfg._rules)
+        self.generating = _derivable_heads(cfg._rules, self.terminals)
+        self.reachable = self._reachable()
+        self.unit_closure = self._unit_closure()
+
+    def _index(self, rule):
+        self.rules_by_head.setdefault(rule[0], set()).add(rule)
+        for symbol in set(rule[1]):
+            self.rules_by_symbol.setdefault(symbol, set()).add(rule)
+
+    def _unindex(self, rule):
+        self.rules_by_head[rule[0]].discard(rule)
+        for symbol in set(rule[1]):
+            self.rules_by_symbol[symbol].discard(rule)
+
+    def _is_nullable(self, body):
+        return all(symbol in self.nullable for symbol in body)
+
+    def _is_generating(self, body):
+        return all(symbol in self.generating or symbol in self.terminals for symbol in body)
+
+    def _propagate(self, found, queue, test):
+        """
+        Adds to found the heads of rules whose bodies pass test, following the rules that contain
+        the variables of queue.
+        """
+        while queue:
+            for head, body in self.rules_by_symbol.get(queue.pop(), ()):
+                if head not in found and test(body):
+                    found.add(head)
+                    queue.append(head)
+
+    def _rules(self):
+        return (rule for rules in self.rules_by_head.values() for rule in rules)
+
+    def _reachable(self):
+        reachable = {self.start_variable}
+        self._reach(reachable, [self.start_variable])
+        return reachable
+
+    def _reach(self, reachable, stack):
+        while stack:
+            for _, body in self.rules_by_head.get(stack.pop(), ()):
+                for symbol in body:
+                    if symbol in self.variables and symbol not in reachable:
+                        reachable.add(symbol)
+                        stack.append(symbol)
+
+    def unit_targets(self, rule):
+        """
+        Returns the variables that the head of rule derives through it as a unit rule.
+        """
+        head, body = rule
+        non_nullable = [symbol for symbol in body if symbol not in self.nullable]
+        if len(non_nullable) > 1:
+            return set()
+        if non_nullable:
+            candidates = non_nullable
+        else:
+            candidates = body
+
+        return {symbol for symbol in candidates if symbol in self.variables and symbol != head}
+
+    def _unit_closure(self):
+        targets = {var: set() for var in self.variables}
+        for rules in self.rules_by_head.values():
+            for rule in rules:
+                targets[rule[0]] |= self.unit_targets(rule)
+
+        closure = {}
+        for var in self.variables:
+            closure[var] = {var}
+            stack = [var]
+            while stack:
+                for target in targets[stack.pop()] - closure[var]:
+                    closure[var].add(target)
+                    stack.append(target)
+
+        return closure
+
+    def add_variable(self, variable):
+        """
+        Adds a variable without rules.
+        """
+        self.variables.add(variable)
+        self.unit_closure.setdefault(variable, {variable})
+
+    def add_rule(self, rule):
+        """
+        Updates the analyses for a new rule. Returns the set of names of the analyses that changed.
+        """
+        head, body = rule
+        self._index(rule)
+        changed = set()
+
+        if head not in self.nullable and self._is_nullable(body):
+            self.nullable.add(head)
+            self._propagate(self.nullable, [head], self._is_nullable)
+            changed.add('nullable')
+
+        if head not in self.generating and self._is_generating(body):
+            self.generating.add(head)
+            self._propagate(self.generating, [head], self._is_generating)
+            changed.add('generating')
+
+        if head in self.reachable:
+            new_vars = {symbol for symbol in body if symbol in self.variables} - self.reachable
+            if new_vars:
+                self.reachable |= new_vars
+                self._reach(self.reachable, list(new_vars))
+                changed.add('reachable')
+
+        if 'nullable' in changed:
+            # Rules that contain the new nullable variables may have become unit rules
+            unit_closure = self._unit_closure()
+            if unit_closure != self.unit_closure:
+                self.unit_closure = unit_closure
+                changed.add('unit_closure')
+        else:
+            for target in self.unit_targets(rule) - self.unit_closure[head]:
+                added = set(self.unit_closure[target])
+                for closure in self.unit_closure.values():
+                    if head in closure:
+                        closure |= added
+                changed.add('unit_closure')
+
+        return changed
+
+    def remove_rule(self, rule):
+        """
+        Updates the analyses for a removed rule. Returns the set of names of the analyses that changed.
+        """
+        head, body = rule
+        was_nullable = self._is_nullable(body)
+        was_generating = self._is_generating(body)
+        was_unit = bool(self.unit_targets(rule))
+        self._unindex(rule)
+        changed = set()
+
+        if was_nullable:
+            nullable, self.nullable = self.nullable, _derivable_heads(self._rules())
+            if self.nullable != nullable:
+                changed.add('nullable')
+
+        if was_generating:
+            generating, self.generating = self.generating, _derivable_heads(self._rules(), self.terminals)
+            if self.generating != generating:
+                changed.add('generating')
+
+        if head in self.reachable:
+            reachable = self._reachable()
+            if reachable != self.reachable:
+                self.reachable = reachable
+                changed.add('reachable')
+
+        if was_unit or 'nullable' in changed:
+            unit_closure = self._unit_closure()
+            if unit_closure != self.unit_closure:
+                self.unit_closure = unit_closure
+                changed.add('unit_closure')
+
+        return changed
+
+
+class CFG(object):
+    """
+    Context free grammar (CFG) class
+
+    Variables and terminals are interned once to small integer ids and every rule is stored as a
+    (head id, body ids tuple) pair, so transforms never have to tokenize rule bodies again. Null
+    rules have an empty body. String bodies are only produced for display.
+    """
+
+    recognition_methods = ('cyk', 'earley', 'll1', 'auto')
+    transform_modes = ('cfg', 'null', 'unit', 'reduct', 'chamsky')
+    # Rules with more nullable symbols are split before their null variants are built
+    max_null_variant_symbols = 3
+
+    def __init__(self,
+                 variables=None,
+                 terminals=None,
+                 rules=None,
+                 start_variable='S',
+                 null_character='λ'):
+        """
+        Initialize method
+
+        Parameters
+            variables (optional): grammar's variables set.
+            terminals: grammar's terminals set
+            rules:  grammar's rules
+            start_variable (optional, defaults to 'S'): grammar's start variable
+            null_character (optional, defaults to 'λ'): grammar's null character
+        """
+
+        if variables is None:
+            variables = set()
+        elif hasattr(variables, '__iter__'):
+            variables = {*variables}
+        else:
+            raise TypeError(
+                "CFG variables must be a iterable, not {}".format(type(variables).__name__)
+            )
+
+        if isinstance(rules, dict):
+            variables |= {*rules}
+            rules = {
+                (var, var_rule)
+                for var, var_rules in rules.items()
+                for var_rule in var_rules
+            }
+        elif hasattr(rules, '__iter__'):
+            rules = {*rules}
+        else:
+            raise TypeError(
+                "CFG rules must be a collection or a dict, not {}".format(type(rules).__name__)
+            )
+
+        if isinstance(terminals, set):
+            terminals = terminals
+        elif hasattr(terminals, '__iter__'):
+            terminals = {*terminals}
+        else:
+            raise TypeError(
+                "CFG variables must be a iterable, not {}".format(type(variables).__name__)
+            )
+
+        self._symbols = ()
+        self._symbol_ids = {}
+        self._tokenizer = None
+        self.variables = variables
+        self.terminals = terminals
+        self.start_variable = start_variable
+        self.null_character = null_character
+        self.accepts_null = None
+        self.rules = rules
+        self._is_chamsky = None
+        self._invalidate()
+        # Stats of transforms and CYK checks, None disables instrumentation
+        self.stats = None
+
+    @classmethod
+    def from_strings(cls, variables, terminals, start_variable, null_character, rules):
+        """
+        Creates a grammar from its text representation, as entered in pyCFG application.
+
+        Parameters
+            variables: comma separated variables
+            terminals: comma separated terminals
+            start_variable: grammar's start variable
+            null_character: grammar's null character
+            rules: rules text, one line per variable in 'A -> x | y' form
+        """
+        parsed_rules = set()
+        for line in rules.strip().split('\n'):
+            line = line.strip()
+            if not line:
+                continue
+
+            line_parts = line.split('->')
+            if len(line_parts) != 2:
+                raise ValueError("Rule syntax error : {}".format(line))
+
+            line_parts = [line_part.strip() for line_part in line_parts]
+
+            for body in line_parts[1].split('|'):
+                body = body.strip()
+                if not body:
+                    raise ValueError("Rule syntax error : {}".format(line))
+
+                parsed_rules.add((line_parts[0], body))
+
+        variables = {variable.strip() for variable in variables.strip().split(',') if variable.strip()}
+        terminals = {terminal.strip() for terminal in terminals.strip().split(',') if terminal.strip()}
+
+        return cls(variables, terminals, parsed_rules, start_variable, null_character)
+
+    @classmethod
+    def from_file(cls, file):
+        """
+        Creates a grammar from a file whose first four lines are the variables, terminals, start
+        variable and null character, and the rest of lines are the rules.
+
+        Parameters
+            file: path or text file object
+        """
+        if isinstance(file, (str, bytes, os.PathLike)):
+            with open(file, encoding='utf-8') as file:
+                return cls.from_file(file)
+
+        lines = [line.rstrip() for line in file]
+        if len(lines) < 4:
+            raise ValueError("Grammar file must start with variables, terminals, start variable and "
+                             "null character lines")
+
+        return cls.from_strings(lines[0], lines[1], lines[2], lines[3], '\n'.join(lines[4:]))
+
+    def to_file_string(self):
+        """
+        Returns the grammar in the file format read by CFG.from_file().
+        """
+        return '\n'.join([
+            ', '.join(sorted(self.variables)),
+            ', '.join(sorted(self.terminals)),
+            self.start_variable,
+            self.null_character,
+            self.str_rules(),
+        ])
+
+    def transformed(self, mode):
+        """
+        Returns a transformed copy of the grammar.
+
+        Parameters
+            mode: one of CFG.transform_modes, 'cfg' (no transform), 'null' (null rules removed),
+                'unit' (null and unit rules removed), 'reduct' (simplified) or 'chamsky' (CNF)
+        """
+        if mode not in self.transform_modes:
+            raise ValueError("Unknown grammar mode '{}'".format(mode))
+
+        cfg = copy(self)
+        if mode == 'null':
+            cfg.remove_null_rules()
+        elif mode == 'unit':
+            cfg.remove_null_rules()
+            cfg.remove_unit_rules()
+        elif mode == 'reduct':
+            cfg.simplify()
+        elif mode == 'chamsky':
+            cfg.chamsky()
+
+        return cfg
+
+    def _intern(self, names):
+        """
+        Returns the ids of passed symbol names, adding unknown names to grammar's symbol table.
+
+        The symbol table is never changed in place, because copies of the grammar share it.
+        """
+        new_names = sorted({name for name in names if name not in self._symbol_ids})
+        if new_names:
+            symbol_ids = dict(self._symbol_ids)
+            for name in new_names:
+                symbol_ids[name] = len(symbol_ids)
+            self._symbol_ids = symbol_ids
+            self._symbols = self._symbols + tuple(new_names)
+
+        return [self._symbol_ids[name] for name in names]
+
+    def _symbol_tokenizer(self):
+        """
+        Returns the Tokenizer of grammar's variables and terminals.
+        """
+        if not self._tokenizer or self._tokenizer[:2] != (self._variable_ids, self._terminal_ids):
+            symbols = {self._symbols[symbol]: symbol for symbol in self._variable_ids | self._terminal_ids}
+            self._tokenizer = self._variable_ids, self._terminal_ids, Tokenizer(symbols)
+
+        return self._tokenizer[2]
+
+    def _terminal_tokenizer(self):
+        """
+        Returns a Tokenizer of grammar's terminals, that splits input strings.
+        """
+        return Tokenizer({self._symbols[terminal]: terminal for terminal in self._terminal_ids})
+
+    def _body_str(self, body):
+        """
+        Returns the string representation of a rule body.
+        """
+        if not body:
+            return self.null_character
+
+        return ''.join(self._symbols[symbol] for symbol in body)
+
+    @property
+    def variables(self):
+        """
+        Grammar's variables set property getter
+        """
+        return frozenset(self._symbols[variable] for variable in self._variable_ids)
+
+    @variables.setter
+    def variables(self, new_variables):
+        """
+        Grammar's variables set property setter
+        """
+        if type(new_variables) is not set:
+            raise TypeError("CFG variables must be a set, not '{}'".format(type(new_variables).__name__))
+
+        for variable in new_variables:
+            if type(variable) is not str:
+                raise TypeError("CFG variables must be strings, not '{}'".format(type(variable).__name__))
+
+        for variable in new_variables:
+            if string_contains_space(variable):
+                raise ValueError("Variables cannot contain white spaces : '{}'".format(variable))
+
+        containments = find_containments(new_variables)
+        if containments:
+            raise ValueError("Variables cannot contain each other, {}".format(
+                ', '.join("'{}' contains '{}'".format(*pair) for pair in sorted(containments))
+            ))
+
+        self._variable_ids = frozenset(self._intern(list(new_variables)))
+        self._is_chamsky = None
+        self._invalidate()
+        self.accepts_null = None
+
+    @property
+    def terminals(self):
+        """
+        Grammar's terminals set property getter
+        """
+        return frozenset(self._symbols[terminal] for terminal in self._terminal_ids)
+
+    @terminals.setter
+    def terminals(self, new_terminals):
+        """
+        Grammar's terminals set property setter
+        """
+        if type(new_terminals) is not set:
+            raise TypeError("CFG terminals must be a set, not '{}'".format(type(new_terminals).__name__))
+
+        for terminal in new_terminals:
+            if type(terminal) is not str:
+                raise TypeError("CFG terminals must be strings, not '{}'".format(type(terminal).__name__))
+
+        for terminal in new_terminals:
+            if string_contains_space(terminal):
+                raise ValueError("Variables cannot contain white spaces : '{}'".format(terminal))
+
+        containments = find_containments(new_terminals)
+        if containments:
+            raise ValueError("Terminals cannot contain each other, {}".format(
+                ', '.join("'{}' contains '{}'".format(*pair) for pair in sorted(containments))
+            ))
+
+        self._terminal_ids = frozenset(self._intern(list(new_terminals)))
+        self._is_chamsky = None
+        self._invalidate()
+        self.accepts_null = None
+
+    @property
+    def rules(self):
+        """
+        Grammar's rules property getter
+
+        Returns a frozenset of (variable, body) string pairs that is built from the interned rules.
+        """
+        return frozenset((self._symbols[head], self._body_str(body)) for head, body in self._rules)
+
+    @rules.setter
+    def rules(self, new_rules):
+        """
+        Grammar's rules property setter
+        """
+        if type(new_rules) is not set:
+            raise TypeError("CFG rules must be a set, not '{}'".format(type(new_rules).__name__))
+
+        for rule in new_rules:
+            self._check_rule_type(rule)
+
+        tokenizer = self._symbol_tokenizer()
+        null_id = self._symbol_ids[self.null_character]
+
+        self._rules = frozenset(self._intern_rule(rule, tokenizer, null_id) for rule in new_rules)
+        self._is_chamsky = None
+        self._invalidate()
+        self.accepts_null = None
+        if (self._symbol_ids[self.start_variable], ()) in self._rules:
+            self.accepts_null = True
+
+    @staticmethod
+    def _check_rule_type(rule):
+        """
+        Raises if rule is not a (variable, body) pair of strings without white spaces.
+        """
+        if type(rule) is not tuple:
+            raise TypeError("CFG rules must be 2-tuples, not '{}'".format(type(rule).__name__))
+        if len(rule) != 2:
+            raise TypeError("CFG rules must be 2-tuples")
+        if type(rule[0]) is not str or type(rule[1]) is not str:
+            raise TypeError("CFG rules must contain strings")
+        if string_contains_space(rule[0]) or string_contains_space(rule[1]):
+            raise ValueError("Rule cannot contain white spaces : '{} -> {}'".format(*rule))
+
+    def _intern_rule(self, rule, tokenizer, null_id):
+        """
+        Returns the (head id, body ids tuple) pair of a (variable, body) string pair.
+        """
+        if self._symbol_ids.get(rule[0]) not in self._variable_ids:
+            raise ValueError("Unknown Variable '{p0}' in '{p0} -> {p1}'".format(
+                p0=rule[0],
+                p1=rule[1]
+            ))
+        body = tokenizer.tokenize(rule[1])
+        if not body:
+            raise ValueError("Rule must contain combination of variables and terminals : '{} -> {}'".format(*rule))
+        body = tuple(body)
+        if null_id in body and body != (null_id,):
+            raise ValueError("Rule cannot combine null character with variables and terminals : '{} -> {}'".format(
+                *rule))
+
+        return self._symbol_ids[rule[0]], () if body == (null_id,) else body
+
+    @property
+    def start_variable(self):
+        """
+        Grammar's start_variable property getter
+        """
+        return self._start_variable
+
+    @start_variable.setter
+    def start_variable(self, new_start_variable):
+        """
+        Grammar's start_variable property setter
+        """
+        if type(new_start_variable) is not str:
+            raise TypeError("CFG start variable must be string, not '{}'".format(type(new_start_variable).__name__))
+
+        if new_start_variable not in self.variables:
+            raise ValueError("Start variable must be in variables set")
+
+        self._start_variable = new_start_variable
+        self._is_chamsky = None
+        self._invalidate()
+        self.accepts_null = None
+
+    @property
+    def null_character(self):
+        """
+        Grammar's null_character property getter
+        """
+        return self._null_character
+
+    @null_character.setter
+    def null_character(self, new_null_character):
+        """
+        Grammar's null_character property setter
+        """
+        if type(new_null_character) is not str:
+            raise TypeError("CFG null character must be string, not '{}'".format(type(new_null_character).__name__))
+
+        if new_null_character not in self.terminals:
+            raise ValueError("Null character must be in terminals set")
+
+        self._null_character = new_null_character
+        self._is_chamsky = None
+        self._invalidate()
+        self.accepts_null = None
+
+    def _invalidate(self):
+        """
+        Drops everything that is computed from grammar's rules: the CNF and its index, the compiled
+        CNF, Earley and LL(1) tables and the incremental analyses.
+        """
+        self._cnf = None
+        self._cnf_index = None
+        self._compiled = None
+        self._earley = None
+        self._ll1 = None
+        self._analysis = None
+
+    def __copy__(self):
+        """
+        Returns a shallow copy of the grammar.
+
+        Incremental analyses, the tokenizer and the cached CNF are updated in place by add_rule() and
+        add_variable(), so the copy gets its own CNF object and builds the others again when needed.
+        """
+        cfg = self.__class__.__new__(self.__class__)
+        cfg.__dict__.update(self.__dict__)
+        cfg._tokenizer = None
+        cfg._analysis = None
+        cfg._cnf_index = None
+        if self._cnf is not None:
+            cfg._cnf = copy(self._cnf)
+
+        return cfg
+
+    def _analyses(self):
+        """
+        Returns the GrammarAnalysis of the grammar.
+        """
+        if self._analysis is None:
+            self._analysis = GrammarAnalysis(self)
+
+        return self._analysis
+
+    def nullable_variables(self):
+        """
+        Returns the set of variables that can generate the null string.
+        """
+        return frozenset(self._symbols[var] for var in self._analyses().nullable)
+
+    def generating_variables(self):
+        """
+        Returns the set of variables that can generate a string of terminals.
+        """
+        return frozenset(self._symbols[var] for var in self._analyses().generating)
+
+    def reachable_variables(self):
+        """
+        Returns the set of variables that appear in some derivation from the start variable.
+        """
+        return frozenset(self._symbols[var] for var in self._analyses().reachable)
+
+    def unit_closure(self):
+        """
+        Returns dict of every variable to the set of variables that it derives through unit rules,
+        including itself and rules that become unit rules when their nullable variables are omitted.
+        """
+        return {self._symbols[var]: frozenset(self._symbols[unit_var] for unit_var in unit_vars)
+                for var, unit_vars in self._analyses().unit_closure.items()}
+
+    def add_variable(self, variable):
+        """
+        Adds a variable without rules to the grammar.
+
+        Only the new variable is validated, and the analyses and CNF of the grammar are kept.
+
+        Parameters
+            variable: the variable string
+        """
+        if type(variable) is not str:
+            raise TypeError("CFG variables must be strings, not '{}'".format(type(variable).__name__))
+        if string_contains_space(variable):
+            raise ValueError("Variables cannot contain white spaces : '{}'".format(variable))
+
+        var_id = self._symbol_ids.get(variable)
+        if var_id in self._variable_ids:
+            return
+        if var_id in self._terminal_ids:
+            raise ValueError("'{}' is a terminal".format(variable))
+
+        containments = sorted(
+            (first, second)
+            for other in self.variables
+            for first, second in ((variable, other), (other, variable))
+            if second in first
+        )
+        if containments:
+            raise ValueError("Variables cannot contain each other, {}".format(
+                ', '.join("'{}' contains '{}'".format(*pair) for pair in containments)
+            ))
+
+        if var_id is None and self._cnf is not None and variable in self._cnf._symbol_ids:
+            # The name is taken by a variable that was created for the CNF
+            self._cnf = None
+
+        tokenizer = self._tokenizer
+        var_id = self._intern([variable])[0]
+        self._variable_ids = self._variable_ids | {var_id}
+        if tokenizer and tokenizer[:2] == (self._variable_ids - {var_id}, self._terminal_ids):
+            tokenizer[2].add(variable, var_id)
+            self._tokenizer = self._variable_ids, self._terminal_ids, tokenizer[2]
+        if self._analysis is not None:
+            self._analysis.add_variable(var_id)
+
+    def add_rule(self, variable, body):
+        """
+        Adds a rule to the grammar.
+
+        Only the new rule is validated. The analyses of the grammar are updated incrementally, and
+        the rules that the new rule adds to the CNF used by CYK algorithm are added to it, unless the
+        rule changes which variables are nullable, generating or unit-derivable.
+
+        Parameters
+            variable: head of the rule
+            body: body of the rule
+        """
+        rule = (variable, body)
+        self._check_rule_type(rule)
+        rule = self._intern_rule(rule, self._symbol_tokenizer(), self._symbol_ids[self.null_character])
+        if rule in self._rules:
+            return
+
+        changed = self._analyses().add_rule(rule)
+        self._rules = self._rules | {rule}
+        self._earley = None
+        self._ll1 = None
+        if rule == (self._symbol_ids[self.start_variable], ()):
+            self.accepts_null = True
+
+        if self._is_chamsky:
+            if len(rule[1]) == 1 and rule[1][0] in self._terminal_ids or \
+                    len(rule[1]) == 2 and all(symbol in self._variable_ids for symbol in rule[1]):
+                self._compiled = None
+                return
+            self._is_chamsky = None
+
+        if self._cnf is not None and not self._patch_cnf(rule, changed):
+            self._cnf = None
+        self._compiled = None
+
+    def remove_rule(self, variable, body):
+        """
+        Removes a rule from the grammar.
+
+        The analyses that the rule could have contributed to are computed again, and the CNF used by
+        CYK algorithm is kept if the rule could not derive any string of terminals.
+
+        Parameters
+            variable: head of the rule
+            body: body of the rule
+        """
+        rule = (variable, body)
+        self._check_rule_type(rule)
+        rule = self._intern_rule(rule, self._symbol_tokenizer(), self._symbol_ids[self.null_character])
+        if rule not in self._rules:
+            raise ValueError("Rule '{} -> {}' is not in grammar".format(variable, body))
+
+        analysis = self._analyses()
+        dead = not analysis._is_generating(rule[1])
+        analysis.remove_rule(rule)
+        self._rules = self._rules - {rule}
+        self._earley = None
+        self._ll1 = None
+        self._compiled = None
+        if rule == (self._symbol_ids[self.start_variable], ()):
+            self.accepts_null = None
+
+        if not dead:
+            self._cnf = None
+
+    def _patch_cnf(self, rule, changed):
+        """
+        Adds the CNF rules of a new rule to the cached CNF of the grammar. Returns False if the new
+        rule changes the CNF in other ways, and the CNF must be computed again.
+        """
+        analysis = self._analysis
+        if changed & {'nullable', 'generating', 'unit_closure'}:
+            return False
+        if not analysis._is_generating(rule[1]):
+            # The rule is removed by reduct
+            return True
+
+        cnf = self._cnf
+        cnf_vars = cnf._variable_ids
+
+        def cnf_id(symbol):
+            return cnf._symbol_ids.get(self._symbols[symbol])
+
+        if cnf_id(rule[0]) not in cnf_vars:
+            return False
+
+        variants = {()}
+        for symbol in rule[1]:
+            with_symbol = {variant + (symbol,) for variant in variants}
+            variants = variants | with_symbol if symbol in analysis.nullable else with_symbol
+        # Single variable variants are unit rules, that the unit closure already accounts for
+        variants = {variant for variant in variants
+                    if len(variant) > 1 or variant and variant[0] in self._terminal_ids}
+        for variant in variants:
+            for symbol in variant:
+                if symbol in analysis.variables and cnf_id(symbol) not in cnf_vars:
+                    return False
+
+        if self._cnf_index is None or self._cnf_index[0] is not cnf:
+            heads = {}
+            for head, body in cnf._rules:
+                heads.setdefault(head, set()).add(body)
+            proxies = {}
+            for head, bodies in sorted(heads.items()):
+                if len(bodies) == 1:
+                    body = next(iter(bodies))
+                    if len(body) == 1 and body[0] in cnf._terminal_ids:
+                        proxies.setdefault(body[0], head)
+            self._cnf_index = cnf, heads, proxies
+        _, heads, proxies = self._cnf_index
+
+        new_heads = [cnf_id(var) for var, unit_vars in analysis.unit_closure.items()
+                     if rule[0] in unit_vars and cnf_id(var) in cnf_vars]
+        for head in new_heads:
+            bodies = heads.get(head, ())
+            if len(bodies) == 1 and len(next(iter(bodies))) == 1:
+                # Variables with a single terminal rule may stand for the terminal in other rules
+                return False
+
+        new_rules = set()
+        new_terminals = set()
+        new_vars = []
+
+        def new_var():
+            if not new_vars or not new_vars[-1]:
+                symbols = [cnf._symbols[symbol] for symbol in cnf._variable_ids | cnf._terminal_ids]
+                symbols += self.variables | self.terminals
+                new_vars.append(CFG._generate_var_names(symbols, 9)[0])
+            var = cnf._intern([new_vars[-1].pop(0)])[0]
+            cnf._variable_ids = cnf._variable_ids | {var}
+            return var
+
+        for variant in variants:
+            body = []
+            for symbol in variant:
+                if symbol in self._terminal_ids:
+                    symbol = cnf._intern([self._symbols[symbol]])[0]
+                    new_terminals.add(symbol)
+                    if len(variant) > 1:
+                        if symbol not in proxies:
+                            proxies[symbol] = new_var()
+                            new_rules.add((proxies[symbol], (symbol,)))
+                        symbol = proxies[symbol]
+                else:
+                    symbol = cnf_id(symbol)
+                body.append(symbol)
+
+            if len(body) == 1:
+                new_rules |= {(head, tuple(body)) for head in new_heads}
+                continue
+
+            for head in new_heads:
+                chain = [head] + [new_var() for _ in range(len(body) - 2)]
+                for i in range(len(chain) - 1):
+                    new_rules.add((chain[i], (body[i], chain[i + 1])))
+                new_rules.add((chain[-1], tuple(body[-2:])))
+
+        for head, body in new_rules:
+            heads.setdefault(head, set()).add(body)
+        cnf._terminal_ids = cnf._terminal_ids | new_terminals
+        cnf._rules = cnf._rules | new_rules
+        cnf._compiled = None
+        return True
+
+    def _nullable_vars(self):
+        """
+        Returns the set of variables that can generate the null string.
+        """
+        return _derivable_heads(self._rules)
+
+    @_instrumented
+    def remove_null_rules(self):
+        """
+        Removes null rules from grammar.
+
+        Every rule is replaced by all of its variants that omit some of its nullable symbols. A rule
+        with more than max_null_variant_symbols nullable symbols is first split into a chain of
+        rules of two symbols through new variables, one per suffix of its body, so that each rule of
+        the chain has at most three variants and the grammar grows linearly instead of
+        exponentially. Variants are built symbol by symbol and deduplicated at each step.
+        """
+        nullable_vars = self._nullable_vars()
+
+        if not nullable_vars:
+            return
+
+        if self._symbol_ids[self.start_variable] in nullable_vars:
+            self.accepts_null = True
+
+        rules = set()
+        suffix_vars = {}
+        fresh_variables = self._fresh_variables()
+        for head, body in self._rules:
+            if sum(symbol in nullable_vars for symbol in body) <= self.max_null_variant_symbols:
+                rules.add((head, body))
+                continue
+
+            # head -> s1 X1, X1 -> s2 X2, ..., Xn-2 -> sn-1 sn, where equal suffixes share a variable
+            for i in range(len(body) - 2):
+                suffix = body[i + 1:]
+                new = suffix not in suffix_vars
+                if new:
+                    suffix_vars[suffix] = next(fresh_variables)
+                rules.add((head, (body[i], suffix_vars[suffix])))
+                if not new:
+                    break
+                head = suffix_vars[suffix]
+                if all(symbol in nullable_vars for symbol in suffix):
+                    nullable_vars.add(head)
+            else:
+                rules.add((head, body[-2:]))
+
+        new_rules = set()
+        for head, body in rules:
+            variants = {()}
+            for symbol in body:
+                with_symbol = {variant + (symbol,) for variant in variants}
+                if symbol in nullable_vars:
+                    variants |= with_symbol
+                else:
+                    variants = with_symbol
+            variants.discard(())
+            new_rules |= {(head, variant) for variant in variants}
+
+        self._variable_ids = self._variable_ids | frozenset(suffix_vars.values())
+        self._rules = frozenset(new_rules)
+        self._invalidate()
+
+    @_instrumented
+    def remove_unit_rules(self):
+        """
+        Removes unit rules from grammar.
+        """
+        unit_rules = {var: set() for var in self._variable_ids}
+        non_unit_rules = {var: set() for var in self._variable_ids}
+        for head, body in self._rules:
+            if len(body) == 1 and body[0] in self._variable_ids:
+                unit_rules[head].add(body[0])
+            else:
+                non_unit_rules[head].add(body)
+
+        new_rules = set()
+        for var in self._variable_ids:
+            related_vars = {var}
+            stack = [var]
+            while stack:
+                for unit_var in unit_rules[stack.pop()] - related_vars:
+                    related_vars.add(unit_var)
+                    stack.append(unit_var)
+
+            for related_var in related_vars:
+                new_rules |= {(var, body) for body in non_unit_rules[related_var]}
+
+        self._rules = frozenset(new_rules)
+        self._invalidate()
+
+    def _generating_vars(self):
+        """
+        Returns the set of variables that can generate a string of terminals.
+        """
+        return _derivable_heads(self._rules, self._terminal_ids)
+
+    @_instrumented
+    def reduct(self):
+        """
+        Reducts grammar's rules.
+        """
+        """
+        Phase 1
+        """
+        v1 = self._generating_vars()
+        p1 = {rule for rule in self._rules
+              if all(symbol in v1 or symbol in self._terminal_ids for symbol in rule[1])}
+
+        """
+        Phase 2
+        """
+        var_bodies = {}
+        for head, body in p1:
+            var_bodies.setdefault(head, []).append(body)
+
+        start_variable = self._symbol_ids[self.start_variable]
+        related_vars = {start_variable}
+        stack = [start_variable]
+        while stack:
+            for body in var_bodies.get(stack.pop(), ()):
+                for symbol in body:
+                    if symbol in v1 and symbol not in related_vars:
+                        related_vars.add(symbol)
+                        stack.append(symbol)
+
+        p1 = {rule for rule in p1 if rule[0] in related_vars}
+
+        t1 = {self._symbol_ids[self.null_character]}
+        for head, body in p1:
+            t1 |= {symbol for symbol in body if symbol in self._terminal_ids}
+
+        self._variable_ids = frozenset(related_vars)
+        self._rules = frozenset(p1)
+        self._invalidate()
+        self._terminal_ids = frozenset(t1)
+
+    @_instrumented
+    def simplify(self):
+        """
+        Simplifies the grammar.
+
+        Results are shared through normal_form_cache by all grammars with the same content.
+        """
+        key = self._cache_key('simplify')
+        if self._restore(normal_form_cache.get(key)):
+            return
+
+        self.remove_null_rules()
         self.remove_unit_rules()
         self.reduct()
+        normal_form_cache.put(key, self._snapshot())
+
+    def _cache_key(self, transform):
+        """
+        Returns the canonical hash of grammar's content and the transform that is applied to it.
+        """
+        content = (
+            transform,
+            sorted(self.variables),
+            sorted(self.terminals),
+            sorted((self._symbols[head], self._body_str(body)) for head, body in self._rules),
+            self.start_variable,
+            self.null_character,
+            bool(self.accepts_null),
+        )
+        return hashlib.sha256(repr(content).encode()).hexdigest()
+
+    def _snapshot(self):
+        """
+        Returns the immutable state of grammar's content.
+        """
+        return (self._symbols, self._symbol_ids, self._variable_ids, self._terminal_ids, self._rules,
+                self.accepts_null, self._is_chamsky)
+
+    def _restore(self, snapshot):
+        """
+        Restores grammar's content from a snapshot. Returns false if snapshot is None.
+        """
+        if snapshot is None:
+            return False
+
+        (self._symbols, self._symbol_ids, self._variable_ids, self._terminal_ids, self._rules,
+         self.accepts_null, self._is_chamsky) = snapshot
+        # The snapshot may number the same symbols differently
+        self._tokenizer = None
+        self._invalidate()
+        return True
 
     @staticmethod
     def _generate_var_names(variables, n, var_name=None):
@@ -440,152 +3037,425 @@ class CFG(object):
                 var_name[z_index] = chr(ord(var_name[z_index]) + 1)
             return var_name
 
-        var_names = []
-        if not var_name:
-            var_name = ['A']
-        while True:
-            contain_each_other = False
-            var_str = ''.join(var_name)
-            for var in variables:
-                contain_each_other, _, _ = strings_contain_each_other(var, var_str)
-                if contain_each_other:
-                    break
-            if contain_each_other:
-                next_var()
-            else:
-                var_names.extend([var_str + str(i) for i in range(1, 10)])
-                next_var()
-                if len(var_names) >= n:
-                    break
+        var_names = []
+        if not var_name:
+            var_name = ['A']
+        while True:
+            contain_each_other = False
+            var_str = ''.join(var_name)
+            for var in variables:
+                contain_each_other, _, _ = strings_contain_each_other(var, var_str)
+                if contain_each_other:
+                    break
+            if contain_each_other:
+                next_var()
+            else:
+                var_names.extend([var_str + str(i) for i in range(1, 10)])
+                next_var()
+                if len(var_names) >= n:
+                    break
+
+        return var_names[:n], var_name
+
+    def _fresh_variables(self):
+        """
+        Yields the ids of new variables, whose names neither contain nor are contained in the names
+        of grammar's variables and terminals, nor in each other.
+        """
+        last_checked_variable = None
+        while True:
+            symbols = [self._symbols[symbol] for symbol in self._variable_ids | self._terminal_ids]
+            names, last_checked_variable = CFG._generate_var_names(symbols, 9, last_checked_variable)
+            for name in names:
+                yield self._intern([name])[0]
+
+    @_instrumented
+    def chamsky(self):
+        """
+        Converts the grammar to Chamsky normal form (CNF).
+
+        Results are shared through normal_form_cache by all grammars with the same content.
+        """
+        key = self._cache_key('chamsky')
+        if self._restore(normal_form_cache.get(key)):
+            return
+
+        fresh_variables = self._fresh_variables()
+
+        def new_var():
+            """
+            Returns the id of a new variable that can be added to grammar variables set.
+            """
+            return next(fresh_variables)
+
+        """
+        Phase 1
+        """
+        self.simplify()
+
+        v1 = set(self._variable_ids)
+        p1 = set()
+        p2 = set()
+
+        def is_terminal(body):
+            return len(body) == 1 and body[0] in self._terminal_ids
+
+        var_rules = {}
+        for head, body in self._rules:
+            var_rules.setdefault(head, []).append(body)
+
+        terminal_rules = {}
+        for var in sorted(self._variable_ids):
+            if len(var_rules.get(var, ())) == 1:
+                if is_terminal(var_rules[var][0]):
+                    terminal_rules[var_rules[var][0][0]] = var
+
+        for rule in self._rules:
+            if is_terminal(rule[1]):
+                p2.add(rule)
+            elif not any(symbol in self._terminal_ids for symbol in rule[1]):
+                p1.add(rule)
+            else:
+                new_body = []
+                for symbol in rule[1]:
+                    if symbol in self._terminal_ids:
+                        if symbol not in terminal_rules:
+                            new_variable = new_var()
+                            terminal_rules[symbol] = new_variable
+                            p2.add((new_variable, (symbol,)))
+                            v1.add(new_variable)
+                        symbol = terminal_rules[symbol]
+                    new_body.append(symbol)
+
+                p1.add((rule[0], tuple(new_body)))
+
+        """
+        Phase 2
+        """
+        for rule in p1:
+            if len(rule[1]) == 2:
+                p2.add(rule)
+            else:
+                new_vars = [new_var() for _ in range(len(rule[1]) - 2)]
+                heads = [rule[0]] + new_vars
+                for i in range(len(new_vars)):
+                    p2.add((heads[i], (rule[1][i], heads[i + 1])))
+                p2.add((heads[-1], rule[1][-2:]))
+                v1 |= set(new_vars)
+
+        self._variable_ids = frozenset(v1)
+        self._rules = frozenset(p2)
+        self._is_chamsky = True
+        self._invalidate()
+        normal_form_cache.put(key, self._snapshot())
+
+    def _first_sets(self, nullable_vars):
+        """
+        Returns dict of variable id to the set of terminal ids that its strings can start with.
+        """
+        first = {var: set() for var in self._variable_ids}
+        changed = True
+        while changed:
+            changed = False
+            for head, body in self._rules:
+                size = len(first[head])
+                first[head] |= self._first_of(body, first, nullable_vars)
+                changed |= size != len(first[head])
+
+        return first
+
+    def _first_of(self, body, first, nullable_vars):
+        """
+        Returns the set of terminal ids that strings of a sequence of symbols can start with.
+        """
+        result = set()
+        for symbol in body:
+            if symbol not in self._variable_ids:
+                result.add(symbol)
+                break
+            result |= first[symbol]
+            if symbol not in nullable_vars:
+                break
+
+        return result
+
+    def _follow_sets(self, first, nullable_vars):
+        """
+        Returns dict of variable id to the set of terminal ids (and END_OF_INPUT) that can follow it.
+        """
+        follow = {var: set() for var in self._variable_ids}
+        follow[self._symbol_ids[self.start_variable]].add(END_OF_INPUT)
+        changed = True
+        while changed:
+            changed = False
+            for head, body in self._rules:
+                for i, symbol in enumerate(body):
+                    if symbol not in self._variable_ids:
+                        continue
+                    size = len(follow[symbol])
+                    rest = body[i + 1:]
+                    follow[symbol] |= self._first_of(rest, first, nullable_vars)
+                    if all(rest_symbol in nullable_vars for rest_symbol in rest):
+                        follow[symbol] |= follow[head]
+                    changed |= size != len(follow[symbol])
+
+        return follow
+
+    def first_sets(self):
+        """
+        Returns dict of variable to the set of terminals that its strings can start with.
+
+        The null character is in the set of variables that can generate the null string.
+        """
+        nullable_vars = self._nullable_vars()
+        return {self._symbols[var]: frozenset(self._symbols[terminal] for terminal in terminals) |
+                ({self.null_character} if var in nullable_vars else frozenset())
+                for var, terminals in self._first_sets(nullable_vars).items()}
+
+    def follow_sets(self):
+        """
+        Returns dict of variable to the set of terminals that can follow it, None stands for end of input.
+        """
+        nullable_vars = self._nullable_vars()
+        follow = self._follow_sets(self._first_sets(nullable_vars), nullable_vars)
+        return {self._symbols[var]: frozenset(None if terminal == END_OF_INPUT else self._symbols[terminal]
+                                              for terminal in terminals)
+                for var, terminals in follow.items()}
+
+    def _ll1_table(self):
+        """
+        Returns (LL1Table or None, list of conflicts) of the grammar.
+        """
+        if self._ll1 is None:
+            nullable_vars = self._nullable_vars()
+            first = self._first_sets(nullable_vars)
+            follow = self._follow_sets(first, nullable_vars)
+
+            cells = {}
+            for head, body in sorted(self._rules):
+                lookaheads = self._first_of(body, first, nullable_vars)
+                if all(symbol in nullable_vars for symbol in body):
+                    lookaheads |= follow[head]
+                for lookahead in lookaheads:
+                    cells.setdefault((head, lookahead), []).append(body)
+
+            conflicts = []
+            for (head, lookahead), bodies in sorted(cells.items()):
+                if len(bodies) > 1:
+                    conflicts.append("Rules {} of '{}' can all be applied on {}".format(
+                        ', '.join("'{} -> {}'".format(self._symbols[head], self._body_str(body)) for body in bodies),
+                        self._symbols[head],
+                        'end of input' if lookahead == END_OF_INPUT else "'{}'".format(self._symbols[lookahead])
+                    ))
+
+            table = None
+            if not conflicts:
+                table = LL1Table(self, {cell: bodies[0] for cell, bodies in cells.items()})
+            self._ll1 = table, conflicts
+
+        return self._ll1
+
+    def ll1_conflicts(self):
+        """
+        Returns the list of reasons why the grammar is not LL(1), it is empty if the grammar is LL(1).
+        """
+        return list(self._ll1_table()[1])
+
+    def is_ll1(self):
+        """
+        Returns true if the grammar is LL(1).
+        """
+        return not self._ll1_table()[1]
+
+    def cyk(self, string, backend='sets'):
+        """
+        Checks if grammar can generate passed string or not.
+
+        Parameters
+            string: the string to check
+            backend (optional, defaults to 'sets'): CYK chart backend, one of CompiledCNF.backends
+        """
+        return self._compile().accepts(string.strip(), backend, self.stats)
+
+    def cyk_many(self, strings, chunk_size=1024, jobs=1):
+        """
+        Checks if grammar can generate each of passed strings or not.
+
+        Returns a generator of bool values in the order of strings. The grammar is converted to
+        CNF once, and strings that share a prefix share the chart cells of the prefix.
+
+        Parameters
+            strings: an iterable of strings, it is consumed lazily
+            chunk_size (optional, defaults to 1024): number of strings that are grouped by prefix
+                and, with more than one job, sent to a worker process at once
+            jobs (optional, defaults to 1): number of worker processes, None means one per CPU
+        """
+        return self._compile().accepts_many((string.strip() for string in strings), chunk_size, jobs)
+
+    def accepts(self, string, method='cyk'):
+        """
+        Checks if grammar can generate passed string or not.
 
-        return var_names[:n], var_name
+        Parameters
+            string: the string to check
+            method (optional, defaults to 'cyk'): recognition algorithm, one of CFG.recognition_methods
+                'cyk': CYK algorithm over the CNF of the grammar
+                'earley': Earley algorithm over grammar's own rules, without converting it to CNF
+                'll1': linear time table-driven LL(1) parser, raises ValueError with the reasons if
+                    the grammar is not LL(1)
+                'auto': 'll1' if the grammar is LL(1), 'earley' otherwise
+        """
+        if method == 'cyk':
+            return self.cyk(string)
 
-    def chamsky(self):
+        if method in ('ll1', 'auto'):
+            table, conflicts = self._ll1_table()
+            if table:
+                return table.accepts(string.strip())
+            if method == 'll1':
+                raise ValueError("Grammar is not LL(1) : {}".format('; '.join(conflicts)))
+            method = 'earley'
+
+        if method == 'earley':
+            return self._earley_grammar().accepts(string.strip())
+
+        raise ValueError("Unknown recognition method '{}'".format(method))
+
+    def parse(self, string):
         """
-        Converts the grammar to Chamsky normal form (CNF).
+        Returns the ParseForest of passed string, or None if grammar cannot generate it.
         """
-        last_checked_variable = None
-        free_variables = []
+        string = string.strip()
+        grammar = self._earley_grammar()
+        if string == self.null_character:
+            return None
 
-        def new_var():
-            """
-            Returns a new variable name that can be added to grammar variables set.
-            """
-            nonlocal free_variables
-            nonlocal v1
-            nonlocal last_checked_variable
+        tokens = grammar.tokenize(string)
+        if tokens is None:
+            return None
 
-            if len(free_variables) == 0:
-                free_variables, last_checked_variable = CFG._generate_var_names(v1, 9, last_checked_variable)
+        recognizer = grammar.recognize(tokens)
+        if len(recognizer.tokens) != len(tokens) or not recognizer.is_complete():
+            return None
 
-            return free_variables.pop(0)
+        return ParseForest(recognizer)
 
+    def count_derivations(self, string):
         """
-        Phase 1
+        Returns the number of parse trees of passed string in grammar's own rules, 0 if grammar
+        cannot generate it.
+
+        Raises ValueError if the string has infinitely many parse trees.
         """
-        self.simplify()
+        forest = self.parse(string)
+        if forest is None:
+            return 0
 
-        v1 = set(self.variables)
-        p1 = set()
-        p2 = set()
+        return forest.count_trees()
 
-        is_terminal = re.compile('|'.join(re_escaped(self.terminals)))
+    def is_ambiguous_on(self, string):
+        """
+        Returns true if passed string has more than one parse tree.
 
-        terminal_rules = {}
-        for var in self.variables:
-            var_rules = [rule[1] for rule in self.rules if rule[0] == var]
-            if len(var_rules) == 1:
-                if is_terminal.fullmatch(var_rules[0]):
-                    terminal_rules[var_rules[0]] = var
+        Counting stops as soon as some part of the string is found to have two derivations.
+        """
+        forest = self.parse(string)
+        if forest is None:
+            return False
 
-        for rule in self.rules:
-            if is_terminal.fullmatch(rule[1]):
-                p2.add(rule)
-            else:
-                rule_terminals = is_terminal.findall(rule[1])
-                if not rule_terminals:
-                    p1.add(rule)
-                else:
-                    old_rule = rule[1]
-                    for rule_terminal in rule_terminals:
-                        if not terminal_rules.get(rule_terminal, None):
-                            new_variable = new_var()
-                            terminal_rules[rule_terminal] = new_variable
-                            p2.add((new_variable, rule_terminal))
-                            v1.add(new_variable)
-                        old_rule = old_rule.replace(rule_terminal, terminal_rules[rule_terminal])
+        try:
+            return forest.count_trees(stop_above=1) > 1
+        except ValueError:
+            return True
+
+    def enumerate(self, max_length=None):
+        """
+        Yields the strings of the language in order of length, then lexicographically.
 
-                    p1.add((rule[0], old_rule))
+        Length is the number of terminals, that is the number of characters when terminals are
+        single characters. Memory does not grow with the number of yielded strings.
 
+        Parameters
+            max_length (optional): length of the longest strings, None means all strings
         """
-        Phase 2
+        compiled = self._compile()
+        if compiled.accepts_null:
+            yield ''
+
+        yield from LanguageEnumerator(compiled).strings(max_length)
+
+    def sample(self, length, k, seed=None):
         """
-        variables_pattern = re.compile('|'.join(re_escaped(v1)))
-        for rule in p1:
-            rule_variables = variables_pattern.findall(rule[1])
-            if len(rule_variables) == 2:
-                p2.add(rule)
-            else:
-                new_vars = [new_var() for _ in range(len(rule_variables) - 2)]
-                p2.add((rule[0], rule_variables.pop(0) + new_vars[-1]))
-                for i in range(len(new_vars) - 2):
-                    p2.add((new_vars[i], new_vars.pop(0) + new_vars[i + 1]))
-                a = rule_variables.pop()
-                b = rule_variables.pop()
-                p2.add((new_vars[-1], b + a))
-                v1 |= set(new_vars)
+        Returns a list of k random strings of the language with passed length, drawn independently.
 
-        self._variables = frozenset(v1)
-        self._rules = frozenset(p2)
-        self._is_chamsky = True
+        Every derivation tree in Chamsky normal form is equally likely, so strings are drawn uniformly
+        when the grammar is not ambiguous and strings with more parse trees are more likely otherwise.
+        Derivation counts are computed once per grammar and kept for later calls, then a string of n
+        terminals takes a number of steps close to linear in n.
 
-    def cyk(self, string):
+        Parameters
+            length: number of terminals of the strings
+            k: number of strings
+            seed (optional): seed of the random generator, for repeatable samples
         """
-        Checks if grammar can generate passed string or not.
+        compiled = self._compile()
+        if compiled._sampler is None:
+            compiled._sampler = LanguageSampler(compiled)
+
+        return compiled._sampler.sample(length, k, random.Random(seed))
+
+    def recognize_stream(self, symbols):
         """
-        string = string.strip()
+        Reads terminals one by one from passed iterable and yields the PrefixStatus of the input
+        read so far after each of them.
+
+        It stops as soon as the input is no longer a prefix of any string of the language, without
+        reading the rest of symbols.
+        """
+        recognizer = OnlineRecognizer(self)
+        for symbol in symbols:
+            status = recognizer.feed(symbol)
+            yield status
+            if not status.viable:
+                return
+
+    def _earley_grammar(self):
+        """
+        Returns the EarleyGrammar of the grammar.
+        """
+        if not self._earley:
+            self._earley = EarleyGrammar(self)
 
+        return self._earley
+
+    def _compile(self):
+        """
+        Returns the CompiledCNF of the grammar, converting a copy of it to CNF if needed.
+        """
         if not self._is_chamsky:
             if not self._cnf:
                 self._cnf = copy(self)
                 self._cnf.chamsky()
             self = self._cnf
 
-        if string == '':
-            if self.accepts_null:
-                return True
-            return False
-
-        if string == self.null_character:
-            return False
-
-        V = [[set() if i != j else {rule[0] for rule in self.rules if rule[1] == string[i]}
-              for j in range(len(string))]
-             for i in range(len(string))]
-
-        variables_pattern = re.compile('|'.join(re_escaped(self.variables)))
-
-        def Vij(i, j):
-            """
-            Calculates V[i][j].
-            """
-            nonlocal V
+        if not self._compiled:
+            if self.stats is None:
+                self._compiled = CompiledCNF(self)
+            else:
+                with self.stats.phase(self, 'compile'):
+                    self._compiled = CompiledCNF(self)
 
-            for k in range(i, j):
-                for rule in self.rules:
-                    rule_variables = variables_pattern.findall(rule[1])
-                    if len(rule_variables) == 2:
-                        if rule_variables[0] in V[i][k] and rule_variables[1] in V[k + 1][j]:
-                            V[i][j].add(rule[0])
+        return self._compiled
 
-        for j in range(len(string) - 1):
-            for i in range(len(string)):
-                if i + 1 + j < len(string):
-                    Vij(i, i + 1 + j)
+    def save_compiled(self, path):
+        """
+        Saves the rules of grammar's CNF to a binary file, that can be loaded by CompiledCNF.load()
+        without normalizing the grammar again.
 
-        if self.start_variable in V[0][-1]:
-            return True
-        return False
+        Parameters
+            path: path of the file
+        """
+        self._compile().save(path)
 
     def str_rules(self, *, return_list=False, prepend='', line_splitter='\n'):
         """
@@ -593,24 +3463,28 @@ class CFG(object):
         """
         rules_var = {}
         vars = set()
-        for rule in self.rules:
-            if not rules_var.get(rule[0], None):
-                rules_var[rule[0]] = []
+        for head, body in self._rules:
+            var = self._symbols[head]
+            if not rules_var.get(var, None):
+                rules_var[var] = []
 
-            rules_var[rule[0]].append(rule[1])
-            if rule[0] != self.start_variable:
-                vars.add(rule[0])
+            rules_var[var].append(self._body_str(body))
+            if var != self.start_variable:
+                vars.add(var)
 
         for rules in rules_var.values():
             rules.sort()
 
         vars = sorted(vars)
-        vars.insert(0, self.start_variable)
-
         if self.accepts_null:
+            rules_var.setdefault(self.start_variable, [])
             if self.null_character not in rules_var[self.start_variable]:
                 rules_var[self.start_variable].append(self.null_character)
 
+        # The start variable has no rules when the language is empty
+        if self.start_variable in rules_var:
+            vars.insert(0, self.start_variable)
+
         str_lines = [prepend + '{} -> {}'.format(var, ' | '.join(rules_var[var])) for var in vars]
 
         if return_list:
@@ -631,3 +3505,445 @@ class CFG(object):
         print_lines.extend(self.str_rules(return_list=True, prepend='\t'))
 
         return "\n".join(print_lines)
+
+
+class FrozenCFG(object):
+    """
+    Immutable and hashable context free grammar class
+
+    Rules are stored per variable, as frozensets of body ids tuples, and transforms return new
+    grammars that reuse the symbol table and the rule sets of the variables they did not change.
+    Many variants of a grammar therefore share most of their storage, and since grammars are
+    compared and hashed by content they can be used as dict keys and in caches.
+
+    Recognition, parsing, LL(1) analysis and generation (cyk, cyk_many, accepts, parse,
+    count_derivations, is_ambiguous_on, recognize_stream, first_sets, follow_sets, ll1_conflicts,
+    is_ll1, enumerate and sample) run on a private CFG that is built on the first of these calls
+    and then cached in the grammar, together with the CNF and the indexes it computes. Such a
+    grammar no longer shares most of its storage; use to_cfg() instead for one-off queries on many
+    variants.
+    """
+
+    __slots__ = ('_symbols', '_symbol_ids', '_variable_ids', '_terminal_ids', '_start_variable',
+                 '_null_character', '_rules', '_accepts_null', '_is_chamsky', '_hash', '_cfg')
+
+    transform_modes = CFG.transform_modes
+
+    def __init__(self,
+                 variables=None,
+                 terminals=None,
+                 rules=None,
+                 start_variable='S',
+                 null_character='λ'):
+        """
+        Initialize method
+
+        Parameters are the same as CFG's.
+        """
+        self._freeze(CFG(variables, terminals, rules, start_variable, null_character), None)
+
+    @classmethod
+    def from_cfg(cls, cfg):
+        """
+        Returns a FrozenCFG with the content of passed CFG, sharing its symbol table.
+        """
+        frozen = cls.__new__(cls)
+        frozen._freeze(cfg, None)
+        return frozen
+
+    def _freeze(self, cfg, parent):
+        """
+        Sets grammar's content from a CFG. Rule sets equal to parent's rule sets are shared with it.
+        """
+        rules = {}
+        for head, body in cfg._rules:
+            rules.setdefault(head, set()).add(body)
+        for head, bodies in rules.items():
+            bodies = frozenset(bodies)
+            if parent is not None and parent._rules.get(head) == bodies:
+                bodies = parent._rules[head]
+            rules[head] = bodies
+
+        (symbols, symbol_ids, variable_ids, terminal_ids, _, accepts_null, is_chamsky) = cfg._snapshot()
+        if parent is not None and parent._symbols == symbols:
+            symbols, symbol_ids = parent._symbols, parent._symbol_ids
+        if parent is not None and parent._variable_ids == variable_ids:
+            variable_ids = parent._variable_ids
+        if parent is not None and parent._terminal_ids == terminal_ids:
+            terminal_ids = parent._terminal_ids
+
+        self._set_state(symbols, symbol_ids, variable_ids, terminal_ids, cfg.start_variable, cfg.null_character,
+                        rules, accepts_null, is_chamsky)
+
+    def to_cfg(self):
+        """
+        Returns a new mutable CFG with the content of the grammar.
+        """
+        cfg = CFG.__new__(CFG)
+        cfg._start_variable = self._start_variable
+        cfg._null_character = self._null_character
+        cfg.stats = None
+        cfg._restore((self._symbols, self._symbol_ids, self._variable_ids, self._terminal_ids,
+                      frozenset((head, body) for head, bodies in self._rules.items() for body in bodies),
+                      self._accepts_null, self._is_chamsky))
+        return cfg
+
+    def _grammar(self):
+        """
+        Returns the CFG that answers recognition and generation queries. It is cached in the _cfg
+        slot, so its CNF and indexes are computed once.
+        """
+        if self._cfg is None:
+            object.__setattr__(self, '_cfg', self.to_cfg())
+
+        return self._cfg
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FrozenCFG is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("FrozenCFG is immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return self._from_state, (self._symbols, self._variable_ids, self._terminal_ids, self._start_variable,
+                                  self._null_character, self._rules, self._accepts_null, self._is_chamsky)
+
+    @classmethod
+    def _from_state(cls, symbols, variable_ids, terminal_ids, start_variable, null_character, rules,
+                    accepts_null, is_chamsky):
+        """
+        Returns a FrozenCFG with passed slots, as saved by __reduce__().
+        """
+        frozen = cls.__new__(cls)
+        frozen._set_state(symbols, {symbol: i for i, symbol in enumerate(symbols)}, variable_ids, terminal_ids,
+                          start_variable, null_character, rules, accepts_null, is_chamsky)
+        return frozen
+
+    def _set_state(self, symbols, symbol_ids, variable_ids, terminal_ids, start_variable, null_character, rules,
+                   accepts_null, is_chamsky):
+        """
+        Sets the slots of a new grammar.
+        """
+        set_slot = object.__setattr__
+        set_slot(self, '_symbols', symbols)
+        set_slot(self, '_symbol_ids', symbol_ids)
+        set_slot(self, '_variable_ids', variable_ids)
+        set_slot(self, '_terminal_ids', terminal_ids)
+        set_slot(self, '_start_variable', start_variable)
+        set_slot(self, '_null_character', null_character)
+        set_slot(self, '_rules', rules)
+        set_slot(self, '_accepts_null', accepts_null)
+        set_slot(self, '_is_chamsky', is_chamsky)
+        set_slot(self, '_hash', None)
+        set_slot(self, '_cfg', None)
+
+    def _key(self):
+        """
+        Returns grammar's content as symbol names, which does not depend on the ids of the symbols.
+
+        Transforms that remove null rules keep the empty string in the language with accepts_null
+        instead of a rule, so it is part of the content.
+        """
+        symbols = self._symbols
+        return (self.variables, self.terminals, self._start_variable, self._null_character,
+                bool(self._accepts_null),
+                frozenset((symbols[head], tuple(symbols[symbol] for symbol in body))
+                          for head, bodies in self._rules.items() for body in bodies))
+
+    def __eq__(self, other):
+        if not isinstance(other, FrozenCFG):
+            return NotImplemented
+        if self is other:
+            return True
+        if self._symbols is other._symbols:
+            return (self._variable_ids == other._variable_ids and self._terminal_ids == other._terminal_ids and
+                    self._start_variable == other._start_variable and
+                    self._null_character == other._null_character and
+                    bool(self._accepts_null) == bool(other._accepts_null) and self._rules == other._rules)
+
+        return self._key() == other._key()
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash(self._key()))
+
+        return self._hash
+
+    @property
+    def variables(self):
+        """
+        Grammar's variables set
+        """
+        return frozenset(self._symbols[variable] for variable in self._variable_ids)
+
+    @property
+    def terminals(self):
+        """
+        Grammar's terminals set
+        """
+        return frozenset(self._symbols[terminal] for terminal in self._terminal_ids)
+
+    @property
+    def rules(self):
+        """
+        Grammar's rules as a frozenset of (variable, body) string pairs
+        """
+        symbols = self._symbols
+        return frozenset(
+            (symbols[head], ''.join(symbols[symbol] for symbol in body) if body else self._null_character)
+            for head, bodies in self._rules.items() for body in bodies
+        )
+
+    @property
+    def start_variable(self):
+        """
+        Grammar's start variable
+        """
+        return self._start_variable
+
+    @property
+    def null_character(self):
+        """
+        Grammar's null character
+        """
+        return self._null_character
+
+    def _transformed(self, transform, *args):
+        """
+        Returns the grammar after passed CFG method, sharing unchanged storage with this grammar.
+        """
+        cfg = self.to_cfg()
+        getattr(cfg, transform)(*args)
+        frozen = self.__class__.__new__(self.__class__)
+        frozen._freeze(cfg, self)
+        return self if frozen == self else frozen
+
+    def add_rule(self, variable, body):
+        """
+        Returns the grammar with a new rule, see CFG.add_rule().
+        """
+        return self._transformed('add_rule', variable, body)
+
+    def remove_rule(self, variable, body):
+        """
+        Returns the grammar without a rule, see CFG.remove_rule().
+        """
+        return self._transformed('remove_rule', variable, body)
+
+    def remove_null_rules(self):
+        """
+        Returns the grammar without null rules.
+        """
+        return self._transformed('remove_null_rules')
+
+    def remove_unit_rules(self):
+        """
+        Returns the grammar without unit rules.
+        """
+        return self._transformed('remove_unit_rules')
+
+    def reduct(self):
+        """
+        Returns the grammar without useless variables.
+        """
+        return self._transformed('reduct')
+
+    def simplify(self):
+        """
+        Returns the grammar without null rules, unit rules and useless variables.
+        """
+        return self._transformed('simplify')
+
+    def chamsky(self):
+        """
+        Returns the grammar in Chamsky normal form.
+        """
+        return self._transformed('chamsky')
+
+    def transformed(self, mode):
+        """
+        Returns the grammar transformed to passed mode, one of FrozenCFG.transform_modes.
+        """
+        if mode not in self.transform_modes:
+            raise ValueError("Unknown grammar mode '{}'".format(mode))
+
+        if mode == 'null':
+            return self.remove_null_rules()
+        elif mode == 'unit':
+            return self.remove_null_rules().remove_unit_rules()
+        elif mode == 'reduct':
+            return self.simplify()
+        elif mode == 'chamsky':
+            return self.chamsky()
+
+        return self
+
+    def cyk(self, string, backend='sets'):
+        """
+        Checks if grammar can generate passed string or not, see CFG.cyk().
+        """
+        return self._grammar().cyk(string, backend)
+
+    def cyk_many(self, strings, chunk_size=1024, jobs=1):
+        """
+        Yields whether grammar can generate each of passed strings, see CFG.cyk_many().
+        """
+        return self._grammar().cyk_many(strings, chunk_size, jobs)
+
+    def accepts(self, string, method='cyk'):
+        """
+        Checks if grammar can generate passed string with passed method, see CFG.accepts().
+        """
+        return self._grammar().accepts(string, method)
+
+    def parse(self, string):
+        """
+        Returns the ParseForest of passed string, or None if grammar cannot generate it, see
+        CFG.parse().
+        """
+        return self._grammar().parse(string)
+
+    def count_derivations(self, string):
+        """
+        Returns the number of parse trees of passed string, see CFG.count_derivations().
+        """
+        return self._grammar().count_derivations(string)
+
+    def is_ambiguous_on(self, string):
+        """
+        Returns true if passed string has more than one parse tree, see CFG.is_ambiguous_on().
+        """
+        return self._grammar().is_ambiguous_on(string)
+
+    def recognize_stream(self, symbols):
+        """
+        Yields the PrefixStatus of the input after each of passed terminals, see CFG.recognize_stream().
+        """
+        return self._grammar().recognize_stream(symbols)
+
+    def first_sets(self):
+        """
+        Returns the FIRST sets of grammar's variables, see CFG.first_sets().
+        """
+        return self._grammar().first_sets()
+
+    def follow_sets(self):
+        """
+        Returns the FOLLOW sets of grammar's variables, see CFG.follow_sets().
+        """
+        return self._grammar().follow_sets()
+
+    def ll1_conflicts(self):
+        """
+        Returns the reasons why the grammar is not LL(1), see CFG.ll1_conflicts().
+        """
+        return self._grammar().ll1_conflicts()
+
+    def is_ll1(self):
+        """
+        Returns true if the grammar is LL(1), see CFG.is_ll1().
+        """
+        return self._grammar().is_ll1()
+
+    def enumerate(self, max_length=None):
+        """
+        Yields the strings of the language by length, then lexicographically, see CFG.enumerate().
+        """
+        return self._grammar().enumerate(max_length)
+
+    def sample(self, length, k, seed=None):
+        """
+        Returns a list of k random strings of passed length, see CFG.sample().
+        """
+        return self._grammar().sample(length, k, seed)
+
+    def to_file_string(self):
+        """
+        Returns the grammar in the file format read by CFG.from_file().
+        """
+        return self.to_cfg().to_file_string()
+
+    def str_rules(self, *, return_list=False, prepend='', line_splitter='\n'):
+        """
+        Returns a human-readable string representation of grammar's rules
+        """
+        return self.to_cfg().str_rules(return_list=return_list, prepend=prepend, line_splitter=line_splitter)
+
+    def __str__(self):
+        """
+        Returns a human-readable string representation of the grammar.
+        """
+        return str(self.to_cfg())
+
+
+def main(argv=None):
+    """
+    Command-line entry point.
+
+        python -m cfg check GRAMMAR [INPUTS] [--jobs N] [--chunk-size N]
+            prints 'accept' or 'reject' and the string for every line of INPUTS (or stdin)
+        python -m cfg show GRAMMAR [--mode MODE]
+            prints the grammar transformed by MODE in grammar file format
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m cfg', description="Context free grammar tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    check = commands.add_parser('check', help="check which input strings the grammar generates")
+    check.add_argument('grammar', help="grammar file")
+    check.add_argument('inputs', nargs='?', default='-',
+                       help="file of newline-delimited strings, defaults to stdin")
+    check.add_argument('--jobs', '-j', type=int, default=1,
+                       help="number of worker processes, 0 or less means one per CPU")
+    check.add_argument('--chunk-size', type=int, default=1024, help="number of strings per batch")
+
+    show = commands.add_parser('show', help="print the transformed grammar")
+    show.add_argument('grammar', help="grammar file")
+    show.add_argument('--mode', choices=CFG.transform_modes, default='chamsky')
+
+    args = parser.parse_args(argv)
+    try:
+        cfg = CFG.from_file(args.grammar)
+    except (OSError, ValueError) as e:
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
+
+    if args.command == 'show':
+        print(cfg.transformed(args.mode).to_file_string())
+        return 0
+
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be positive")
+    jobs = args.jobs if args.jobs > 0 else None
+
+    try:
+        inputs = sys.stdin if args.inputs == '-' else open(args.inputs, encoding='utf-8')
+    except OSError as e:
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, e))
+    try:
+        # The tee only buffers the strings that are being checked ahead of the output
+        strings, labels = tee(line.rstrip('\n') for line in inputs)
+        results = cfg.cyk_many(strings, chunk_size=args.chunk_size, jobs=jobs)
+        for batch in chunks(zip(results, labels), args.chunk_size):
+            sys.stdout.write(''.join(
+                '{}\t{}\n'.format('accept' if accepted else 'reject', string) for accepted, string in batch
+            ))
+    finally:
+        if inputs is not sys.stdin:
+            inputs.close()
+
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    # Imported by name, so worker processes unpickle the same classes
+    from cfg import main
+
+    sys.exit(main())
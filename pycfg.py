@@ -7,6 +7,8 @@ Author : Hamidreza Mahdavipanah
 Repository: http://github.com/mahdavipanah/pyCFG
 License : MIT License
 """
+import queue
+import threading
 import tkinter
 import tkinter.scrolledtext
 from tkinter import messagebox
@@ -14,7 +16,13 @@ from tkinter import filedialog
 import webbrowser
 from copy import copy
 
-from cfg import CFG
+from cfg import CFG, PhaseStats, Stats
+
+
+class _Cancelled(Exception):
+    """
+    Raised in a background job when it is cancelled.
+    """
 
 
 class pyCFG(tkinter.Tk):
@@ -96,6 +104,23 @@ class pyCFG(tkinter.Tk):
         self.string_entry.grid(row=0, column=1, sticky=tkinter.NSEW)
         tkinter.Button(self.string_frame, text="Check", command=self._check_string).grid(row=0, column=2)
 
+        self.status_frame = tkinter.Frame(self)
+        self.status_frame.grid(row=9, column=0, columnspan=4, sticky=tkinter.NSEW)
+        self.status_frame.columnconfigure(0, weight=1)
+        self.status_label = tkinter.Label(self.status_frame, anchor=tkinter.W)
+        self.status_label.grid(row=0, column=0, sticky=tkinter.NSEW)
+        self.cancel_button = tkinter.Button(self.status_frame, text="Cancel", command=self._cancel_job,
+                                            state=tkinter.DISABLED)
+        self.cancel_button.grid(row=0, column=1)
+
+        # Background jobs put (job id, kind, value) tuples in the queue, that is polled by after()
+        self.job_results = queue.Queue()
+        self.job_id = 0
+        self.job_cancel = None
+        self.job_done = None
+        self.job_polling = False
+        self.shown_mode = 0
+
         self._change_widgets_state(tkinter.DISABLED)
 
         self.about_window = None
@@ -112,72 +137,132 @@ class pyCFG(tkinter.Tk):
         self.cfg = [None for _ in range(5)]
 
     def _check_string(self):
-        if self.cfg[4].cyk(self.string_entry.get()):
-            messagebox.showinfo("CYK algorithm", "Grammar can generate entered string")
-        else:
-            messagebox.showerror("CYK algorithm", "Grammar cannot generate entered string")
+        string = self.string_entry.get()
+        chamsky = self.cfg[4]
+        transform = self._transform_job(4)
 
-    def _evaluate(self):
-        self._change_widgets_state(tkinter.DISABLED)
+        def job(stats):
+            cfg = chamsky or transform(stats)
+            return cfg, cfg.cyk(string)
 
-        try:
-            rules = set()
-            for line in self.rules_text.get("1.0", 'end-1c').strip().split('\n'):
-                line = line.strip()
-                if not line:
-                    continue
+        def done(result):
+            self.cfg[4] = result[0]
+            if result[1]:
+                messagebox.showinfo("CYK algorithm", "Grammar can generate entered string")
+            else:
+                messagebox.showerror("CYK algorithm", "Grammar cannot generate entered string")
 
-                line_parts = line.split('->')
-                if len(line_parts) != 2:
-                    raise ValueError("Rule syntax error : {}".format(line))
+        self._start_job("Checking string", job, done)
 
-                line_parts = [line_part.strip() for line_part in line_parts]
+    def _evaluate(self):
+        self._cancel_job()
+        self._change_widgets_state(tkinter.DISABLED)
 
-                if line_parts[1].count('|') != 0:
-                    second_parts = line_parts[1].split('|')
-                    for second_part in second_parts:
-                        second_part = second_part.strip()
-                        if not second_part:
-                            raise ValueError("Rule syntax error : {}".format(line))
+        try:
+            _cfg = CFG.from_strings(self.variables_entry.get(), self.terminals_entry.get(),
+                                    self.start_variable_entry.get(), self.null_character_entry.get(),
+                                    self.rules_text.get("1.0", 'end-1c'))
 
-                        rules.add((line_parts[0], second_part))
+        except ValueError as e:
+            messagebox.showerror("Input CFG Error", e.args[0])
+            self.cfg = [None for _ in range(5)]
+            return
 
-                else:
-                    rules.add((line_parts[0], line_parts[1]))
+        # Other modes are computed when they are selected for the first time
+        self.cfg = [_cfg] + [None for _ in range(4)]
+        self._change_widgets_state(tkinter.NORMAL)
+        self._change_grammar_mode()
 
-            variables = set()
-            for variable in self.variables_entry.get().strip().split(','):
-                variable = variable.strip()
-                if not variable:
-                    continue
+    def _start_job(self, title, job, done):
+        """
+        Runs job(stats) on a background thread and calls done(result) on the event loop.
+
+        The job reports the transforms it finishes through stats, and it is stopped at the end of
+        the next transform when it is cancelled.
+        """
+        self.job_id += 1
+        job_id = self.job_id
+        cancel = threading.Event()
+        self.job_cancel = cancel
+        self.job_done = done
+
+        def progress(record):
+            if cancel.is_set():
+                raise _Cancelled()
+            self.job_results.put((job_id, 'progress', record))
+
+        def worker():
+            try:
+                self.job_results.put((job_id, 'done', job(Stats(callback=progress))))
+            except _Cancelled:
+                pass
+            except Exception as e:
+                self.job_results.put((job_id, 'error', e))
+
+        self._set_busy(True)
+        self.status_label['text'] = title + "..."
+        threading.Thread(target=worker, daemon=True).start()
+        if not self.job_polling:
+            self.job_polling = True
+            self.after(50, self._poll_job)
+
+    def _poll_job(self):
+        """
+        Handles the messages of background jobs, results of cancelled jobs are dropped.
+        """
+        while True:
+            try:
+                job_id, kind, value = self.job_results.get_nowait()
+            except queue.Empty:
+                break
+
+            if job_id != self.job_id:
+                continue
+
+            if kind == 'progress':
+                if isinstance(value, PhaseStats):
+                    self.status_label['text'] = "{} done in {:.2f}s, {} rules".format(
+                        value.name, value.seconds, value.rules_after)
+                continue
+
+            done = self.job_done
+            self._finish_job()
+            self.job_polling = False
+            if kind == 'error':
+                messagebox.showerror("Error", str(value))
+            else:
+                done(value)
+            return
 
-                variables.add(variable)
+        if self.job_cancel is not None:
+            self.after(50, self._poll_job)
+        else:
+            self.job_polling = False
 
-            terminals = set()
-            for terminal in self.terminals_entry.get().strip().split(','):
-                terminal = terminal.strip()
-                if not terminal:
-                    continue
+    def _cancel_job(self):
+        if self.job_cancel is None:
+            return
 
-                terminals.add(terminal)
+        self.job_cancel.set()
+        self._finish_job()
+        self.grammar_mode.set(self.shown_mode)
 
-            _cfg = CFG(variables, terminals, rules, self.start_variable_entry.get(), self.null_character_entry.get())
+    def _finish_job(self):
+        self.job_id += 1
+        self.job_cancel = None
+        self.job_done = None
+        self.status_label['text'] = ''
+        self._set_busy(False)
 
-            cfg = [copy(_cfg) for _ in range(5)]
-            cfg[1].remove_null_rules()
-            cfg[2].remove_null_rules()
-            cfg[2].remove_unit_rules()
-            cfg[3].simplify()
-            cfg[4].chamsky()
+    def _set_busy(self, busy):
+        state = tkinter.DISABLED if busy else tkinter.NORMAL
+        for rb in self.radioButtons:
+            rb['state'] = state
 
-        except ValueError as e:
-            messagebox.showerror("Input CFG Error", e.args[0])
-            self.cfg = [None for _ in range(5)]
-            return
+        for child in self.string_frame.winfo_children():
+            child['state'] = state
 
-        self.cfg = cfg
-        self._change_widgets_state(tkinter.NORMAL)
-        self._change_grammar_mode()
+        self.cancel_button['state'] = tkinter.NORMAL if busy else tkinter.DISABLED
 
     def _load_from_file(self):
         file_name = filedialog.askopenfilename(title="Choose a file as input")
@@ -274,7 +359,36 @@ class pyCFG(tkinter.Tk):
         self.rules_text.insert("1.0", rules)
 
     def _change_grammar_mode(self):
-        cfg = self.cfg[self.grammar_mode.get()]
+        mode = self.grammar_mode.get()
+        if self.cfg[mode] is not None:
+            self._show_grammar(mode)
+            return
+
+        def done(cfg):
+            self.cfg[mode] = cfg
+            self.grammar_mode.set(mode)
+            self._show_grammar(mode)
+
+        self._start_job("Computing " + self.radioButtons[mode]['text'], self._transform_job(mode), done)
+
+    def _transform_job(self, mode):
+        """
+        Returns a background job that transforms the evaluated grammar to passed mode.
+        """
+        _cfg = self.cfg[0]
+
+        def job(stats):
+            cfg = copy(_cfg)
+            cfg.stats = stats
+            cfg = cfg.transformed(CFG.transform_modes[mode])
+            cfg.stats = None
+            return cfg
+
+        return job
+
+    def _show_grammar(self, mode):
+        self.shown_mode = mode
+        cfg = self.cfg[mode]
         self._fill_inputs(' ,'.join(cfg.variables),
                           ' ,'.join(cfg.terminals),
                           cfg.start_variable,
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
+import io
+import pickle
 import pytest
 
-from itertools import product
-from cfg import CFG
+from itertools import islice, product
+
+import bench
+from cfg import CFG, CompiledCNF, FrozenCFG, IncrementalRecognizer, OnlineRecognizer, Stats, main, normal_form_cache
 
 
 def test_old_behavior():
@@ -61,3 +65,689 @@ def test_without_variables():
     assert observed == expected
 
 
+def test_rules_are_interned():
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['aSb', 'λ']}
+    )
+
+    assert g.rules == {('S', 'aSb'), ('S', 'λ')}
+    assert g.accepts_null
+
+def test_long_rules():
+    g = CFG(
+        terminals={'a', 'b', 'c', 'd', 'λ'},
+        rules={'S': ['abcd', 'aSd', 'λ']}
+    )
+
+    observed = {x for x in ['', 'ad', 'abcd', 'aabcdd', 'abc', 'abdc'] if g.cyk(x)}
+    expected = {'', 'ad', 'abcd', 'aabcdd'}
+
+    assert observed == expected
+
+
+def test_balanced_parentheses():
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    observed = {x for x in map(''.join, product(*['()'] * 6)) if g.cyk(x)}
+    expected = {'((()))', '(()())', '(())()', '()(())', '()()()'}
+
+    assert observed == expected
+
+
+def test_bitset_backend():
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    for string in map(''.join, product(*['()'] * 6)):
+        assert g.cyk(string, backend='bitset') == g.cyk(string)
+
+    assert g.cyk('(()' * 40 + '))' * 20, backend='bitset')
+    assert not g.cyk('(()' * 40 + ')' * 39, backend='bitset')
+
+
+def test_numpy_backend():
+    pytest.importorskip('numpy')
+
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    for string in map(''.join, product(*['()'] * 6)):
+        assert g.cyk(string, backend='numpy') == g.cyk(string)
+
+    assert g.cyk('(()' * 40 + '))' * 20, backend='numpy')
+    assert not g.cyk('(()' * 40 + ')' * 39, backend='numpy')
+
+
+def test_numpy_backend_fallback(monkeypatch):
+    import cfg
+    monkeypatch.setattr(cfg, 'numpy', None)
+
+    g = CFG(
+        terminals={'a', 'b', 'c', 'λ'},
+        rules={'S': ['aSa', 'bSb', 'cSc', 'λ']}
+    )
+
+    observed = {x for x in map(''.join, product(*['abc'] * 4)) if g.cyk(x, backend='numpy')}
+    expected = {'aaaa', 'abba', 'acca', 'baab', 'bbbb', 'bccb', 'caac', 'cbbc', 'cccc'}
+
+    assert observed == expected
+
+
+def test_cyk_many():
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    strings = ['', 'λ', '()', '(x)'] + [''.join(p) for p in product(*['()'] * 8)]
+    observed = g.cyk_many(iter(strings), chunk_size=50)
+
+    assert not isinstance(observed, list)
+    assert list(observed) == [g.cyk(x) for x in strings]
+
+
+def test_cyk_many_jobs():
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    strings = [''.join(p) for p in product(*['()'] * 8)]
+
+    assert list(g.cyk_many(strings, chunk_size=16, jobs=2)) == list(g.cyk_many(strings))
+
+
+def test_earley():
+    g = CFG(
+        terminals={'a', 'b', 'c', 'λ'},
+        rules={'S': ['aSa', 'bSb', 'cSc', 'λ']}
+    )
+
+    observed = {x for x in map(''.join, product(*['abc'] * 4)) if g.accepts(x, method='earley')}
+    expected = {'aaaa', 'abba', 'acca', 'baab', 'bbbb', 'bccb', 'caac', 'cbbc', 'cccc'}
+
+    assert observed == expected
+
+
+def test_earley_null_rules():
+    g = CFG(
+        terminals={'a', 'b', '+', 'λ'},
+        rules={'S': ['AB', 'S+S'], 'A': ['a', 'λ'], 'B': ['b', 'AA', 'λ']}
+    )
+
+    for string in ['', 'a', 'b', 'ab', 'aaa', 'a+', '+', 'a+ab', 'ba', 'aab+aaa']:
+        assert g.accepts(string, method='earley') == (string == '' or g.cyk(string))
+
+    with pytest.raises(ValueError):
+        g.accepts('ab', method='unknown')
+
+
+def test_empty_string_after_transforms():
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aSb', 'λ']})
+    for mode in CFG.transform_modes:
+        t = g.transformed(mode)
+        for string in ['', 'ab', 'aabb', 'a']:
+            expected = t.cyk(string)
+            assert t.accepts(string, method='earley') == expected
+            assert t.accepts(string, method='auto') == expected
+            assert (t.parse(string) is not None) == expected
+        assert t.cyk('') and t.count_derivations('') == 1
+        assert list(t.parse('').trees()) == [('S', ())]
+        status = t.recognize_stream('ab')
+        assert [s.complete for s in status] == [False, True]
+
+    t = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aB', 'λ'], 'B': ['b']}).transformed('null')
+    assert t.is_ll1() and t.accepts('', method='ll1') and t.accepts('ab', method='ll1')
+
+
+def test_ll1():
+    g = CFG(
+        terminals={'a', '+', '*', '(', ')', 'λ'},
+        rules={'E': ['TX'], 'X': ['+TX', 'λ'], 'T': ['FY'], 'Y': ['*FY', 'λ'], 'F': ['(E)', 'a']},
+        start_variable='E'
+    )
+
+    assert g.first_sets()['X'] == {'+', 'λ'}
+    assert g.follow_sets()['T'] == {'+', ')', None}
+    assert g.is_ll1()
+
+    for string in ['a', 'a+a*a', '(a+a)*a', 'a+', '(a', 'a**a', '', 'λ']:
+        assert g.accepts(string, method='ll1') == g.accepts(string, method='earley')
+
+
+def test_not_ll1():
+    g = CFG(
+        terminals={'a', '+', 'λ'},
+        rules={'E': ['E+a', 'a']},
+        start_variable='E'
+    )
+
+    assert not g.is_ll1()
+    assert g.ll1_conflicts() == ["Rules 'E -> E+a', 'E -> a' of 'E' can all be applied on 'a'"]
+    assert g.accepts('a+a', method='auto')
+
+    with pytest.raises(ValueError):
+        g.accepts('a+a', method='ll1')
+
+
+def test_incremental_recognizer():
+    g = CFG(
+        terminals={'(', ')', 'λ'},
+        rules={'S': ['SS', '(S)', 'λ']}
+    )
+
+    recognizer = IncrementalRecognizer(g, '(()')
+    assert not recognizer.accepts()
+
+    recognizer.append(')')
+    assert recognizer.string == '(())'
+    assert recognizer.accepts()
+
+    recognizer.insert(2, '(')
+    assert recognizer.string == '((())' and not recognizer.accepts()
+    recognizer.insert(3, ')')
+    assert recognizer.string == '((()))' and recognizer.accepts()
+
+    recognizer.delete(0)
+    assert recognizer.string == '(()))' and not recognizer.accepts()
+    recognizer.delete(4)
+    assert recognizer.string == '(())' and recognizer.accepts()
+
+    for _ in range(4):
+        recognizer.delete(0)
+    assert recognizer.string == '' and recognizer.accepts()
+
+    with pytest.raises(IndexError):
+        recognizer.delete(0)
+
+    # The initial string is split into terminals like cyk does
+    g = CFG(terminals={'if', 'then', 'x', 'λ'}, rules={'S': ['ifxthenS', 'x']})
+    recognizer = IncrementalRecognizer(g, 'ifxthenx')
+    assert g.cyk('ifxthenx') and recognizer.accepts() and len(recognizer) == 4
+    assert not IncrementalRecognizer(g, 'ifythenx').accepts()
+
+
+def test_online_recognizer():
+    g = CFG(
+        terminals={'a', '+', '(', ')', 'λ'},
+        rules={'E': ['E+T', 'T'], 'T': ['(E)', 'a', 'D'], 'D': ['aD']},
+        start_variable='E'
+    )
+
+    recognizer = OnlineRecognizer(g)
+    assert recognizer.status() == (True, False, {'(', 'a'})
+    assert recognizer.feed('(') == (True, False, {'(', 'a'})
+    assert recognizer.feed('a') == (True, False, {'+', ')'})
+    assert recognizer.feed(')') == (True, True, {'+'})
+    assert recognizer.feed(')') == (False, False, set())
+    assert recognizer.feed('a') == (False, False, set())
+
+
+def test_recognize_stream():
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['aSb', 'λ']}
+    )
+
+    symbols = iter('aabbba')
+    observed = [(status.viable, status.complete) for status in g.recognize_stream(symbols)]
+
+    assert observed == [(True, False), (True, False), (True, False), (True, True), (False, False)]
+    assert list(symbols) == ['a']
+
+
+def test_parse_forest():
+    g = CFG(
+        terminals={'a', '+', 'λ'},
+        rules={'E': ['E+E', 'a']},
+        start_variable='E'
+    )
+
+    forest = g.parse('a+a+a')
+    assert forest.root.symbol == 'E'
+    assert forest.root.families[0][0] == ('E', 'E+E')
+
+    a = ('E', ('a',))
+    assert set(forest.trees()) == {('E', (('E', (a, '+', a)), '+', a)), ('E', (a, '+', ('E', (a, '+', a))))}
+
+    assert g.parse('a+') is None
+    assert len(list(g.parse('+'.join('a' * 8)).trees())) == 429
+
+
+def test_parse_forest_null_rules():
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['AB'], 'A': ['a', 'λ'], 'B': ['b', 'λ']}
+    )
+
+    assert list(g.parse('').trees()) == [('S', (('A', ()), ('B', ())))]
+    assert list(g.parse('b').trees()) == [('S', (('A', ()), ('B', ('b',))))]
+    assert g.parse('ba') is None
+
+
+def test_count_derivations():
+    g = CFG(
+        terminals={'a', '+', 'λ'},
+        rules={'E': ['E+E', 'a']},
+        start_variable='E'
+    )
+
+    assert [g.count_derivations('+'.join('a' * n)) for n in range(1, 9)] == [1, 1, 2, 5, 14, 42, 132, 429]
+    assert g.count_derivations('+'.join('a' * 40)) == 680425371729975800390
+    assert g.count_derivations('a+') == 0
+
+    assert not g.is_ambiguous_on('a+a')
+    assert g.is_ambiguous_on('a+a+a')
+    assert not g.is_ambiguous_on('+a')
+
+
+def test_count_derivations_cycles():
+    g = CFG(
+        terminals={'a', 'λ'},
+        rules={'S': ['A'], 'A': ['B', 'a'], 'B': ['A']}
+    )
+
+    assert g.is_ambiguous_on('a')
+
+    with pytest.raises(ValueError):
+        g.count_derivations('a')
+
+
+def test_remove_null_rules():
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['A' * 30 + 'b'], 'A': ['a', 'λ']}
+    )
+
+    g.remove_null_rules()
+
+    assert ('A', 'λ') not in g.rules and len(g.rules) < 100
+    assert all(g.cyk('a' * i + 'b') for i in range(31)) and not g.cyk('a' * 31 + 'b')
+
+    # Short rules get all their variants
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['AbA'], 'A': ['a', 'λ']})
+    g.remove_null_rules()
+    assert g.rules == {('S', 'AbA'), ('S', 'Ab'), ('S', 'bA'), ('S', 'b'), ('A', 'a')}
+
+    # Distinct nullable variables do not multiply the variants
+    names = ['<{}>'.format(i) for i in range(24)]
+    g = CFG(terminals={'a', 'λ'}, rules=dict({'S': [''.join(names)]}, **{name: ['a', 'λ'] for name in names}))
+    g.remove_null_rules()
+    assert len(g.rules) < 200
+    assert g.accepts_null and g.cyk('a') and g.cyk('a' * 24) and not g.cyk('a' * 25)
+
+
+def test_indirectly_nullable_start_variable():
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['AB'], 'A': ['a', 'λ'], 'B': ['b', 'λ']}
+    )
+
+    assert {x for x in ['', 'a', 'b', 'ab', 'ba'] if g.cyk(x)} == {'', 'a', 'b', 'ab'}
+
+
+def test_symbols_containing_each_other():
+    with pytest.raises(ValueError) as error:
+        CFG(
+            variables={'S', 'AB', 'B', 'C', 'ABC'},
+            terminals={'a', 'λ'},
+            rules={'S': ['a']}
+        )
+
+    assert error.value.args[0] == ("Variables cannot contain each other, 'AB' contains 'B', 'ABC' contains 'AB', "
+                                   "'ABC' contains 'B', 'ABC' contains 'C'")
+
+    with pytest.raises(ValueError) as error:
+        CFG(terminals={'ab', 'b', 'λ'}, rules={'S': ['b']})
+
+    assert error.value.args[0] == "Terminals cannot contain each other, 'ab' contains 'b'"
+
+    with pytest.raises(ValueError) as error:
+        CFG(variables={'S', ''}, terminals={'a', 'λ'}, rules={'S': ['a']})
+
+    assert error.value.args[0] == "Variables cannot contain each other, 'S' contains ''"
+
+    with pytest.raises(ValueError) as error:
+        CFG(terminals={'a', '', 'λ'}, rules={'S': ['a']})
+
+    assert error.value.args[0] == "Terminals cannot contain each other, 'a' contains '', 'λ' contains ''"
+
+
+def test_multi_character_terminals():
+    g = CFG(
+        terminals={'if', 'then', 'x', 'λ'},
+        rules={'S': ['ifCthenS', 'x'], 'C': ['x']}
+    )
+
+    assert g.rules == {('S', 'ifCthenS'), ('S', 'x'), ('C', 'x')}
+
+    for method in CFG.recognition_methods:
+        assert g.accepts('ifxthenx', method=method)
+        assert g.accepts('ifxthenifxthenx', method=method)
+        assert not g.accepts('ifxthen', method=method)
+        assert not g.accepts('ifthenx', method=method)
+
+    assert g.cyk('ifxthenx', backend='bitset')
+    assert list(g.cyk_many(['x', 'ifxthenx', 'ifx'])) == [True, True, False]
+
+
+def test_normal_form_cache():
+    def grammar():
+        return CFG(
+            terminals={'a', 'b', 'λ'},
+            rules={'S': ['aSb', 'A', 'λ'], 'A': ['a', 'λ']}
+        )
+
+    normal_form_cache.clear()
+    g1 = grammar()
+    g1.chamsky()
+    assert normal_form_cache.info() == (0, 2, 256, 2)
+
+    g2 = grammar()
+    g2.chamsky()
+    assert normal_form_cache.info() == (1, 2, 256, 2)
+    assert g2.rules == g1.rules and g2.variables == g1.variables
+    assert g2.accepts_null == g1.accepts_null
+    assert all(g2.cyk(x) == g1.cyk(x) for x in ['', 'a', 'ab', 'aab', 'aabb', 'ba'])
+
+    g3 = grammar()
+    g3.simplify()
+    assert normal_form_cache.info().hits == 2
+
+    normal_form_cache.maxsize = 1
+    assert normal_form_cache.info().currsize == 1
+
+    normal_form_cache.maxsize = 0
+    grammar().chamsky()
+    assert normal_form_cache.info().currsize == 0
+    normal_form_cache.maxsize = 256
+
+
+def test_compiled_file(tmp_path):
+    g = CFG(
+        terminals={'if', 'then', 'x', 'λ'},
+        rules={'S': ['ifCthenS', 'x', 'SS'], 'C': ['x', 'λ']}
+    )
+    path = str(tmp_path / 'grammar.cnf')
+    g.save_compiled(path)
+    compiled = CompiledCNF.load(path)
+
+    strings = ['', 'x', 'xx', 'ifthenx', 'ifxthenx', 'ifxthen', 'ifthenifxthenxx', 'y']
+    for backend in CompiledCNF.backends:
+        assert [compiled.accepts(x, backend) for x in strings] == [g.cyk(x) for x in strings]
+    # Workers load the file themselves
+    assert list(compiled.accepts_many(strings, jobs=2)) == [g.cyk(x) for x in strings]
+
+    with open(path, 'r+b') as file:
+        file.seek(-1, 2)
+        file.write(b'?')
+    with pytest.raises(ValueError):
+        CompiledCNF.load(path)
+
+    with open(path, 'wb') as file:
+        file.write(b'not a grammar')
+    with pytest.raises(ValueError):
+        CompiledCNF.load(path)
+
+
+def test_grammar_file(tmp_path):
+    path = tmp_path / 'grammar.txt'
+    path.write_text('S, A\na, b, λ\nS\nλ\nS -> aSb | A | λ\n\nA -> a\n', encoding='utf-8')
+
+    g = CFG.from_file(str(path))
+    assert g.rules == {('S', 'aSb'), ('S', 'A'), ('S', 'λ'), ('A', 'a')}
+
+    for mode in CFG.transform_modes:
+        transformed = g.transformed(mode)
+        assert CFG.from_file(io.StringIO(transformed.to_file_string())).str_rules() == transformed.str_rules()
+    assert g.rules == {('S', 'aSb'), ('S', 'A'), ('S', 'λ'), ('A', 'a')}
+
+    with pytest.raises(ValueError) as error:
+        CFG.from_strings('S', 'a, λ', 'S', 'λ', 'S -> a |')
+    assert error.value.args[0] == "Rule syntax error : S -> a |"
+
+
+def test_command_line(tmp_path, monkeypatch, capsys):
+    grammar = tmp_path / 'grammar.txt'
+    grammar.write_text('S\n(, ), λ\nS\nλ\nS -> SS | (S) | λ\n', encoding='utf-8')
+    inputs = tmp_path / 'inputs.txt'
+    inputs.write_text('()\n\n)(\n(())()\n', encoding='utf-8')
+    expected = 'accept\t()\naccept\t\nreject\t)(\naccept\t(())()\n'
+
+    assert main(['check', str(grammar), str(inputs), '--chunk-size', '2']) == 0
+    assert capsys.readouterr().out == expected
+
+    assert main(['check', str(grammar), str(inputs), '--jobs', '2']) == 0
+    assert capsys.readouterr().out == expected
+
+    with pytest.raises(SystemExit) as error:
+        main(['check', str(grammar), str(tmp_path / 'missing.txt')])
+    assert error.value.code == 1
+    assert 'missing.txt' in capsys.readouterr().err
+
+    monkeypatch.setattr('sys.stdin', io.StringIO(inputs.read_text(encoding='utf-8')))
+    assert main(['check', str(grammar)]) == 0
+    assert capsys.readouterr().out == expected
+
+    assert main(['show', str(grammar), '--mode', 'null']) == 0
+    assert capsys.readouterr().out == 'S\n(, ), λ\nS\nλ\nS -> () | (S) | S | SS | λ\n'
+
+    # Grammars of the empty language have no rules left for the start variable
+    empty = tmp_path / 'empty.txt'
+    empty.write_text('S, A\na, λ\nS\nλ\nS -> A\nA -> aA\n', encoding='utf-8')
+    for mode in ('reduct', 'chamsky'):
+        assert main(['show', str(empty), '--mode', mode]) == 0
+        assert capsys.readouterr().out == 'S\nλ\nS\nλ\n\n'
+
+
+def test_benchmarks():
+    for generator in bench.generators.values():
+        g = generator(3)
+        assert g.transformed('chamsky').cyk('a') == g.cyk('a')
+
+    results = bench.run('quick', repeat=1, selected=['ambiguous'])
+    assert len(results) == len(bench.sizes['quick']) * (4 + len(bench.input_lengths['quick']))
+    assert all(result['grammar'] == 'ambiguous' and result['seconds'] >= 0 for result in results)
+    assert bench.compare(results, results)[0].endswith('1.00x')
+
+
+def test_stats():
+    normal_form_cache.clear()
+    g = CFG(
+        terminals={'a', 'b', 'λ'},
+        rules={'S': ['aSb', 'A', 'λ'], 'A': ['a', 'λ']}
+    )
+    records = []
+    g.stats = Stats(callback=records.append)
+
+    assert g.cyk('aab')
+    assert not g.cyk('ba')
+    assert records == g.stats.phases + g.stats.cyk
+
+    names = [phase.name for phase in g.stats.phases]
+    assert names == ['remove_null_rules', 'remove_unit_rules', 'reduct', 'simplify', 'chamsky', 'compile']
+    chamsky = g.stats.phases[4]
+    assert (chamsky.variables_before, chamsky.rules_before) == (2, 5)
+    assert chamsky.rules_after > chamsky.rules_before
+    assert all(phase.seconds >= 0 for phase in g.stats.phases)
+
+    check = g.stats.cyk[0]
+    assert check.length == 3 and check.accepted
+    assert check.cells_filled == 6
+    assert check.split_points == 1 * 2 + 2 * 1
+    assert check.rule_probes > 3
+    assert check.peak_chart_bytes > 0
+    assert g.stats.cyk[1].accepted is False
+
+    # Every backend is timed itself and reports its own counters
+    for backend in ('bitset', 'numpy'):
+        assert g.cyk('aab', backend=backend)
+        check = g.stats.cyk[-1]
+        assert check.length == 3 and check.accepted
+        assert (check.cells_filled, check.split_points) == (6, 4)
+        assert check.rule_probes > 3 and check.peak_chart_bytes > 0
+
+    g.stats = None
+    assert g.cyk('aab')
+
+
+def test_add_rule():
+    g = CFG(variables={'S', 'A', 'B'}, terminals={'a', 'b', 'λ'}, rules={'S': ['AB'], 'A': ['a']})
+    assert g.generating_variables() == {'A'}
+    assert not g.cyk('ab')
+
+    g.add_rule('B', 'b')
+    assert g.generating_variables() == {'S', 'A', 'B'}
+    assert g.reachable_variables() == {'S', 'A', 'B'}
+    assert g.cyk('ab')
+
+    cnf = g._cnf
+    g.add_rule('S', 'aSb')
+    g.add_rule('S', 'aabb')
+    assert g._cnf is cnf
+    assert g.cyk('aabb') and g.cyk('aaabbb') and not g.cyk('aab')
+
+    g.add_rule('B', 'λ')
+    assert g.nullable_variables() == {'B'}
+    assert g.unit_closure()['S'] == {'S', 'A'}
+    assert g.cyk('a') and g.cyk('aab') and not g.cyk('b')
+
+    g.add_variable('C')
+    g.add_rule('S', 'C')
+    g.add_rule('C', 'bb')
+    assert g.unit_closure()['S'] == {'S', 'A', 'C'}
+    assert g.cyk('bb') and g.cyk('abbb')
+
+    fresh = CFG(variables=set(g.variables), terminals=set(g.terminals), rules=set(g.rules))
+    strings = [''.join(p) for n in range(7) for p in product('ab', repeat=n)]
+    assert [g.cyk(x) for x in strings] == [fresh.cyk(x) for x in strings]
+
+    with pytest.raises(ValueError):
+        g.add_rule('D', 'a')
+    with pytest.raises(ValueError):
+        g.add_variable('CC')
+    with pytest.raises(ValueError):
+        g.add_variable('a')
+
+
+def test_remove_rule():
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aSb', 'A', 'λ'], 'A': ['a', 'aA']})
+    assert g.cyk('') and g.cyk('aab')
+
+    g.remove_rule('S', 'λ')
+    assert g.nullable_variables() == set()
+    assert not g.cyk('') and g.cyk('aab') and not g.cyk('ab')
+
+    g.remove_rule('S', 'A')
+    assert g.reachable_variables() == {'S'}
+    assert g.generating_variables() == {'A'}
+    assert not g.cyk('aab')
+
+    with pytest.raises(ValueError) as error:
+        g.remove_rule('S', 'A')
+    assert error.value.args[0] == "Rule 'S -> A' is not in grammar"
+
+    # The CNF cached before a transform must not be patched afterwards
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['a', 'b']})
+    assert g.cyk('a')
+    g.chamsky()
+    g.remove_rule('S', 'b')
+    g.add_rule('S', 'aS')
+    assert not g.cyk('b') and g.cyk('aa')
+
+
+def test_enumerate():
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aSb', 'SS', 'λ']})
+    strings = [''.join(p) for n in range(7) for p in product('ab', repeat=n)]
+    assert list(g.enumerate(6)) == [x for x in strings if g.cyk(x)]
+    assert list(g.enumerate(4)) == ['', 'ab', 'aabb', 'abab']
+
+    # Ambiguous grammars yield every string once
+    g = CFG(terminals={'a', 'λ'}, rules={'S': ['SS', 'a']})
+    assert list(g.enumerate(4)) == ['a', 'aa', 'aaa', 'aaaa']
+
+    # Finite languages end without a limit
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['AB', 'B'], 'A': ['a', 'λ'], 'B': ['b', 'bb']})
+    assert list(g.enumerate()) == ['b', 'ab', 'bb', 'abb']
+
+    g = CFG(terminals={'a', 'λ'}, rules={'S': ['SS', 'aS']})
+    assert list(g.enumerate()) == []
+
+    # Long strings of an infinite language
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aSb', 'ab']})
+    assert list(islice(g.enumerate(), 30))[-1] == 'a' * 30 + 'b' * 30
+
+
+def test_sample():
+    g = CFG(terminals={'(', ')', 'λ'}, rules={'S': ['(S)S', 'λ']})
+    strings = g.sample(6, 1000, seed=0)
+    assert len(strings) == 1000 and all(len(x) == 6 and g.cyk(x) for x in strings)
+    assert set(strings) == {'((()))', '(()())', '(())()', '()(())', '()()()'}
+    assert g.sample(6, 10, seed=1) == g.sample(6, 10, seed=1)
+    assert g.sample(0, 2) == ['', '']
+
+    with pytest.raises(ValueError) as error:
+        g.sample(5, 1)
+    assert error.value.args[0] == "Language has no string of length 5"
+    with pytest.raises(ValueError):
+        g.sample(-1, 1)
+    with pytest.raises(ValueError):
+        g.sample(2, -1)
+
+    g = CFG(terminals={'a', 'b', 'λ'}, rules={'S': ['aSb', 'ab']})
+    assert g.sample(40, 1) == ['a' * 20 + 'b' * 20]
+
+
+def test_frozen_cfg():
+    rules = {'S': ['aSb', 'A', 'λ'], 'A': ['a', 'aA', 'B'], 'B': ['b']}
+    g = FrozenCFG(terminals={'a', 'b', 'λ'}, rules=rules)
+    assert g == FrozenCFG(terminals={'a', 'b', 'λ'}, rules=rules)
+    assert len({g, FrozenCFG(terminals={'a', 'b', 'λ'}, rules=rules)}) == 1
+    assert g == FrozenCFG.from_cfg(CFG(terminals={'a', 'b', 'λ'}, rules=rules))
+
+    with pytest.raises(AttributeError):
+        g.start_variable = 'A'
+    with pytest.raises(AttributeError):
+        g.stats = None
+
+    # Transforms return new grammars and keep the rule sets they did not change
+    cfg = CFG(terminals={'a', 'b', 'λ'}, rules=rules)
+    cfg.remove_unit_rules()
+    u = g.remove_unit_rules()
+    assert u != g and u.rules == cfg.rules
+    assert u._rules[u._symbol_ids['B']] is g._rules[g._symbol_ids['B']]
+    assert u._symbols is g._symbols
+    assert g.reduct() is g
+    assert g.rules == CFG(terminals={'a', 'b', 'λ'}, rules=rules).rules
+    assert g._cfg is None
+
+    c = g.transformed('chamsky')
+    assert c == FrozenCFG.from_cfg(CFG(terminals={'a', 'b', 'λ'}, rules=rules).transformed('chamsky'))
+    assert c.cyk('aab') and g.cyk('aab') and not g.cyk('ba')
+
+    h = g.add_rule('B', 'ba')
+    assert h.cyk('aba') and not g.cyk('aba')
+    assert h.remove_rule('B', 'ba') == g
+    assert h._rules[h._symbol_ids['A']] is g._rules[g._symbol_ids['A']]
+
+    assert g.to_cfg().rules == g.rules
+    assert g.count_derivations('aab') == 2 and g.is_ambiguous_on('aab') and not g.is_ambiguous_on('a')
+    assert [status.complete for status in g.recognize_stream('aba')] == [True, True, False]
+    assert g.first_sets() == g.to_cfg().first_sets() and g.follow_sets() == g.to_cfg().follow_sets()
+    assert g.is_ll1() == (not g.ll1_conflicts())
+    assert pickle.loads(pickle.dumps(c)) == c
+
+    # The empty string kept by removing null rules is part of the content
+    n = FrozenCFG(terminals={'a', 'λ'}, rules={'S': ['a', 'λ']}).remove_null_rules()
+    m = FrozenCFG(terminals={'a', 'λ'}, rules={'S': ['a']})
+    assert n.rules == m.rules and n != m and n.cyk('') and not m.cyk('')
+    assert len({n: 1, m: 2}) == 2
+    assert pickle.loads(pickle.dumps(n)) == n and pickle.loads(pickle.dumps(n)).cyk('')